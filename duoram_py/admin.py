@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import argparse, socket, time
+from wire import pack_u8, pack_u32, recv_exact, read_u8, read_u32, read_i64
+
+# Operator commands for one bank server (run them against each party).
+OP_SNAPSHOT        = 0x50
+OP_SNAPSHOT_STATUS = 0x51
+OP_RESIZE          = 0x52
+OP_INFO            = 0x53
+
+STATES = ["idle", "running", "done", "failed"]
+
+def connect(hostport):
+    h,p = hostport.split(":")
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((h, int(p)))
+    return s
+
+def snapshot(hp, name):
+    s = connect(hp)
+    data = name.encode()
+    s.sendall(pack_u8(OP_SNAPSHOT) + pack_u32(len(data)) + data)
+    recv_exact(s, 2)  # "OK"
+    s.close()
+
+def snapshot_status(hp):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_SNAPSHOT_STATUS))
+    state, done, total = read_u8(s), read_i64(s), read_i64(s)
+    s.close()
+    return STATES[state], done, total
+
+# Grow the table to rows rows; returns the row count the server now has.
+# Run it against both parties: until both have grown, clients keep using the
+# old size and only see the old rows.
+def resize(hp, rows):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_RESIZE) + pack_u32(rows))
+    rows = read_u32(s)
+    s.close()
+    return rows
+
+def info(hp):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_INFO))
+    rows, width = read_u32(s), read_u32(s)
+    s.close()
+    return rows, width
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--op", required=True, choices=["snapshot","status","resize","info"])
+    ap.add_argument("--server", required=True)
+    ap.add_argument("--name", default="share.npy")
+    ap.add_argument("--wait", action="store_true")
+    ap.add_argument("--rows", type=int, default=None)
+    args = ap.parse_args()
+
+    if args.op == "resize":
+        if args.rows is None: raise SystemExit("--rows required")
+        print(f"RESIZE -> {resize(args.server, args.rows)} rows")
+        return
+    if args.op == "info":
+        rows, width = info(args.server)
+        print(f"{rows} rows x {width}")
+        return
+
+    if args.op == "snapshot":
+        snapshot(args.server, args.name)
+        print(f"SNAPSHOT {args.name} started")
+
+    while True:
+        state, done, total = snapshot_status(args.server)
+        print(f"{state} {done}/{total} bytes")
+        if not args.wait or state != "running": break
+        time.sleep(0.5)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import asyncio, collections
+
+# Admission control for reads: at most max_inflight reads run at once and at
+# most max_queue wait for a slot; beyond that a read is turned away at once
+# with Busy (the client is told to retry after retry_ms). Waiting reads are
+# queued per client and a freed slot goes to the clients in turn, so one busy
+# client cannot starve the others; max_per_client (0: no limit) also caps how
+# many reads one client may have queued or running.
+class Busy(Exception):
+    def __init__(self, retry_ms):
+        super().__init__(f"busy, retry after {retry_ms} ms")
+        self.retry_ms = retry_ms
+
+class Admission:
+    def __init__(self, max_inflight, max_queue, max_per_client, retry_ms):
+        self.max_inflight, self.max_queue = max_inflight, max_queue
+        self.max_per_client, self.retry_ms = max_per_client, retry_ms
+        self.inflight = 0
+        self.queued = 0
+        self.queues = collections.OrderedDict()  # client -> deque of futures, in turn order
+        self.per_client = collections.Counter()
+
+    async def enter(self, client):
+        if self.max_per_client and self.per_client[client] >= self.max_per_client:
+            raise Busy(self.retry_ms)
+        if self.inflight < self.max_inflight and not self.queued:
+            self.inflight += 1
+        elif self.queued >= self.max_queue:
+            raise Busy(self.retry_ms)
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(client, collections.deque()).append(fut)
+            self.queued += 1
+            self.per_client[client] += 1
+            try:
+                await fut  # leave() hands its slot over
+            except asyncio.CancelledError:
+                self._forget(client)
+                if fut.done() and not fut.cancelled(): self.leave_slot()
+                else: self._unqueue(client, fut)
+                raise
+            return
+        self.per_client[client] += 1
+
+    def leave(self, client):
+        self._forget(client)
+        self.leave_slot()
+
+    def _forget(self, client):
+        self.per_client[client] -= 1
+        if not self.per_client[client]: del self.per_client[client]
+
+    # pass the slot to the client whose turn it is, or free it
+    def leave_slot(self):
+        while self.queues:
+            client, q = next(iter(self.queues.items()))
+            fut = q.popleft()
+            self.queued -= 1
+            if q: self.queues.move_to_end(client)
+            else: del self.queues[client]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.inflight -= 1
+
+    def _unqueue(self, client, fut):
+        q = self.queues.get(client)
+        if q is None or fut not in q: return
+        q.remove(fut)
+        self.queued -= 1
+        if not q: del self.queues[client]
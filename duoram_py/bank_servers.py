@@ -1,179 +1,794 @@
 #!/usr/bin/env python3
-import argparse, socket, struct
+import argparse, asyncio, collections, itertools, os, shutil, signal, struct, tempfile
+import numpy as np
+from ring import RingShare, RING_DTYPE, to_i64, ring_dot, ring_matmul, set_threads
+from wire import pack_u8, pack_u32, pack_i64, encode_vec, decode_vec, aread_u8, aread_u32, aread_i64, aread_vec
+from peer_link import PeerLink
+from share_store import open_store
+from wal import WriteAheadLog, KIND_VEC, KIND_DPF, KIND_RESIZE, KIND_FIELD, KIND_TRANSFER
+from snapshot import Snapshotter, load_npy
+from read_workers import ReadWorkers, SharedVersion
+from epochs import Epochs, EpochGone
+from read_batcher import ReadBatcher, FLAT, ROWS
+from admission import Admission, Busy
+from triple_pool import TriplePool
+from premask import Premasks
+from write_order import WriteOrder
+import dpf
 
 # user <-> party ops
-OP_WRITE_VEC   = 0x40
-OP_READ_SECURE = 0x41
+# writes carry a wid (the same on both parties, see write_order.py) right after
+# the op; an overwrite's rid is its wid. OP_WRITE_VEC keeps its original frame
+# with no wid: the parties pair those writes up by arrival order, as they do
+# OP_READ_SECURE reads, so they must come from one writer at a time.
+OP_WRITE_VEC   = 0x40  # [op][dim:u32][vec:dim*i64]                   -> "OK"
+OP_WRITE_VEC_WID = 0x4B  # [op][wid:i64][dim:u32][vec:dim*i64]        -> "OK"
+OP_WRITE_DPF   = 0x46  # [op][wid:i64][rows:u32][len:u32][dpf key]                -> "OK"
+OP_ADD_DPF     = 0x47  # [op][wid:i64][rows:u32][field:u32][len:u32][dpf key]     -> "OK" (adds to one i64 field of a row)
+OP_TRANSFER_DPF = 0x48  # [op][wid:i64][rows:u32][field:u32]{[len:u32][dpf key]}*2 -> "OK" (debit key, credit key)
+OP_OVERWRITE_DPF = 0x49  # [op][rid:i64][rows:u32][len:u32][dpf read key][width:u32][new:width*i64] -> "OK"
+OP_READ_SECURE = 0x41  # [op][dim:u32][e:dim*i64]            -> [share:i64]
+OP_READ_RID    = 0x42  # [op][rid:i64][dim:u32][e:dim*i64]   -> [READ_OK][share:i64]
+OP_READ_BATCH  = 0x43  # [op][rid:i64][dim:u32][k:u32][E:k*dim*i64] -> [READ_OK][shares:k*i64]
+OP_READ_ROWS   = 0x44  # [op][rid:i64][rows:u32][k:u32][E:k*rows*i64] -> [READ_OK][width:u32][shares:k*width*i64]
+OP_READ_DPF    = 0x45  # [op][rid:i64][rows:u32][k:u32]{[len:u32][dpf key]}*k  -> [READ_OK][width:u32][shares:k*width*i64]
+OP_AGGREGATE   = 0x4A  # [op][rid:i64][mode:u8][n:u32][weights:n*i64] -> [READ_OK][width:u32][sums:width*i64]
+# aggregate modes: the sum of all rows, a public weighted sum of the first n
+# rows, or a weighted sum whose weights are secret-shared (a row read)
+AGG_SUM, AGG_PUBLIC, AGG_SHARED = 0, 1, 2
+# reads with a rid reply with a status byte first; READ_BUSY is followed by
+# [retry after:u32] (milliseconds) and nothing else, READ_ERROR (the request
+# was rejected or failed) by [len:u32][message]
+READ_OK, READ_BUSY, READ_ERROR = 0, 1, 2
+
+# admin ops
+OP_SNAPSHOT        = 0x50  # [op][len:u32][file name]  -> "OK" (runs in the background)
+OP_SNAPSHOT_STATUS = 0x51  # [op] -> [state:u8][bytes written:i64][total bytes:i64]
+OP_RESIZE          = 0x52  # [op][rows:u32] -> [rows:u32] (grow only; run on both parties)
+OP_INFO            = 0x53  # [op] -> [rows:u32][width:u32]
+
+# reads a read worker can serve: they carry a rid right after the op
+ROUTED_OPS = (OP_READ_RID, OP_READ_BATCH, OP_READ_ROWS, OP_READ_DPF, OP_AGGREGATE)
+# ops the peer runs together with this one under the same rid, aborted there if they fail here
+ABORTABLE_OPS = ROUTED_OPS + (OP_OVERWRITE_DPF,)
+
+EPOCH_ROUNDS = 4  # copies a read worker makes to match its peer's epoch
+
+# A record is one row of STR_SIZE ring elements (must match user_facing_api.py).
+STR_SIZE = 10
 
 # pairing server ops
-OP_REQUEST  = 0x31
-OP_RESPONSE = 0x33
-
-# ---------- BE helpers ----------
-def pack_u8(x):  return struct.pack("!B", x)
-def pack_u32(x): return struct.pack("!I", x & 0xFFFFFFFF)
-def pack_i64(x): return struct.pack("!q", int(x))
-def recv_exact(sock, n):
-    b = b""
-    while len(b) < n:
-        chunk = sock.recv(n - len(b))
-        if not chunk: raise ConnectionError("eof")
-        b += chunk
-    return b
-def read_u8(s):  return struct.unpack("!B", recv_exact(s,1))[0]
-def read_u32(s): return struct.unpack("!I", recv_exact(s,4))[0]
-def read_i64(s): return struct.unpack("!q", recv_exact(s,8))[0]
-
-# ---------- net utils ----------
-def connect(host, port):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect((host, port))
-    return s
+OP_REQUEST     = 0x31
+OP_REQUEST_RID = 0x32
+OP_RESPONSE    = 0x33
+OP_REQUEST_BATCH  = 0x34
+OP_RESPONSE_BATCH = 0x35
 
-# ---------- algebra ----------
-def dot(a,b): return sum(x*y for x,y in zip(a,b))
-
-# ---------- residual exchange (send TWO vectors: u_part then v_part; both int64) ----------
-def send_two_vecs(host, port, sid, tag, vec_u_part, vec_v_part):
-    s = connect(host, port)
-    s.sendall(pack_i64(sid))
-    s.sendall(pack_u8(tag))
-    s.sendall(pack_u32(len(vec_u_part)))
-    for v in vec_u_part: s.sendall(pack_i64(v))
-    s.sendall(pack_u32(len(vec_v_part)))
-    for v in vec_v_part: s.sendall(pack_i64(v))
-    s.close()
-
-def recv_two_vecs(acceptor, expect_sid, expect_tag, expect_dim):
-    s, _ = acceptor.accept()
-    sid = read_i64(s)
-    tag = read_u8(s)
-    dim1 = read_u32(s)
-    if sid!=expect_sid or tag!=expect_tag or dim1!=expect_dim:
-        s.close()
-        raise RuntimeError("peer residual header mismatch (u_part)")
-    u_part = [read_i64(s) for _ in range(dim1)]
-    dim2 = read_u32(s)
-    if dim2!=expect_dim:
-        s.close()
-        raise RuntimeError("peer residual header mismatch (v_part)")
-    v_part = [read_i64(s) for _ in range(dim2)]
-    s.close()
-    return u_part, v_part
-
-# ---------- Du-Atallah cross-term (no mod) ----------
+# ---------- residual exchange (any number of ring vectors in one frame) ----------
+# body: [dim:u32][vec:dim*i64] repeated
+async def send_vecs(link, sid, tag, *vecs):
+    parts = []
+    for v in vecs: parts += [pack_u32(len(v)), encode_vec(v)]
+    await link.send(sid, tag, *parts)
+
+async def recv_vecs(link, expect_sid, expect_tag, *expect_dims):
+    body, off, vecs = memoryview(await link.recv(expect_sid, expect_tag)), 0, []
+    for k, expect_dim in enumerate(expect_dims):
+        dim = struct.unpack_from("!I", body, off)[0]
+        if dim!=expect_dim: raise RuntimeError(f"peer residual header mismatch (vec {k})")
+        vecs.append(decode_vec(body[off+4:off+4+8*dim]))
+        off += 4+8*dim
+    return vecs
+
+# Both parties push their residuals at the same time and read the peer's while
+# their own are still draining, so both directions of the link are busy at once.
+async def exchange_vecs(link, sid, tag, *vecs):
+    _, theirs = await asyncio.gather(send_vecs(link, sid, tag, *vecs),
+                                     recv_vecs(link, sid, tag, *[len(v) for v in vecs]))
+    return theirs
+
+# ---------- Du-Atallah cross-term (mod 2^64) ----------
 # Build public u = x - a, v = y - b via additive parts, then:
 #   A: s =  u·b_A + a_A·v + c_A
 #   B: s =  u·b_B + a_B·v + u·v + c_B
-def dta_cross(role, io_acceptor, peer_host, peer_port, sid, tag,
-              i_am_X_side, my_input, a_i, b_i, c_i):
-    dim = len(my_input)
-
+def dta_parts(i_am_X_side, my_input, a_i, b_i):
     if i_am_X_side:
-        u_part_me = [ my_input[i] - a_i[i] for i in range(dim) ]  # x - a_i
-        v_part_me = [ -b_i[i]               for i in range(dim) ]  # -b_i
-        send_two_vecs(peer_host, peer_port, sid, tag, u_part_me, v_part_me)
-        u_part_pe, v_part_pe = recv_two_vecs(io_acceptor, sid, tag, dim)
+        return my_input - a_i, -b_i  # x - a_i, -b_i
     else:
-        u_part_me = [ -a_i[i]               for i in range(dim) ]  # -a_i
-        v_part_me = [ my_input[i] - b_i[i] for i in range(dim) ]  # y - b_i
-        u_part_pe, v_part_pe = recv_two_vecs(io_acceptor, sid, tag, dim)
-        send_two_vecs(peer_host, peer_port, sid, tag, u_part_me, v_part_me)
-
-    u = [ u_part_me[i] + u_part_pe[i] for i in range(dim) ]  # x - (a0+a1)
-    v = [ v_part_me[i] + v_part_pe[i] for i in range(dim) ]  # y - (b0+b1)
+        return -a_i, my_input - b_i  # -a_i, y - b_i
 
+def dta_finish(role, u, v, a_i, b_i, c_i):
     if role == "A":
-        return dot(u, b_i) + dot(a_i, v) + c_i
+        return ring_dot(u, b_i) + ring_dot(a_i, v) + c_i
     else:
-        return dot(u, b_i) + dot(a_i, v) + dot(u, v) + c_i
+        return ring_dot(u, b_i) + ring_dot(a_i, v) + ring_dot(u, v) + c_i
+
+# Both cross terms of a read, A_A·e_B (tag 0x01, A is X side) and A_B·e_A
+# (tag 0x10, B is X side), only need the local share and the query, so their
+# residuals travel together: one round trip to the peer instead of two.
+TAG_CROSS = 0x11
+
+# ---------- epoch agreement ----------
+# Each party sends the epoch its share is at (see epochs.py); the read then
+# uses the smaller one, which both parties have. A also sends the sid of the
+# prefetched triple it drew for the read (0: none, see triple_pool.py).
+# body: [epoch:i64][sid:i64]
+TAG_EPOCH = 0x12
+
+# A read one party gives up on (turned away, timed out) is aborted at the
+# other party too instead of leaving it waiting for the exchange: [retry after:u32]
+TAG_ABORT = 0x14
+
+# -> (the peer's epoch, the peer's sid)
+async def exchange_epoch(link, key, mine, sid=0):
+    _, body = await asyncio.gather(link.send(key, TAG_EPOCH, pack_i64(mine) + pack_i64(sid)),
+                                   link.recv(key, TAG_EPOCH))
+    return struct.unpack("!qq", body)
+
+# -> (agreed epoch, the peer's sid)
+async def agree_epoch(link, key, mine, sid=0):
+    theirs, peer_sid = await exchange_epoch(link, key, mine, sid)
+    return min(mine, theirs), peer_sid
+
+async def dta_cross_fused(role, link, sid, my_share, e_share, a_i, b_i, c_i):
+    u01_me, v01_me = dta_parts(role=="A", my_share if role=="A" else e_share, a_i, b_i)
+    u10_me, v10_me = dta_parts(role=="B", my_share if role=="B" else e_share, a_i, b_i)
+    u01_pe, v01_pe, u10_pe, v10_pe = await exchange_vecs(
+        link, sid, TAG_CROSS, u01_me, v01_me, u10_me, v10_me)
+
+    z01 = dta_finish(role, u01_me + u01_pe, v01_me + v01_pe, a_i, b_i, c_i)
+    z10 = dta_finish(role, u10_me + u10_pe, v10_me + v10_pe, a_i, b_i, c_i)
+    return z01 + z10
+
+# ---------- batched cross terms (matrix Du-Atallah) ----------
+# The query side holds L (k x dim), the data side R (dim x width); with a triple
+# (A, B, C = A·B) we open U = L - A and V = R - B, then:
+#   A: s = U·B_A + A_A·V + C_A
+#   B: s = U·B_B + A_B·V + U·V + C_B
+def dta_finish_mat(role, U, V, A_i, B_i, C_i):
+    s = ring_matmul(U, B_i) + ring_matmul(A_i, V) + C_i
+    if role == "B": s += ring_matmul(U, V)
+    return s
+
+# 0x01 multiplies B's queries by A's share, 0x10 A's queries by B's share.
+# masked, if given, is this party's data-side residual my_share - B computed
+# ahead of time (see premask.py).
+async def dta_cross_batch(role, link, sid, my_share, E_share, triples, masked=None):
+    (A01, B01, C01), (A10, B10, C10) = triples
+    def data_side(A_i, B_i): return -A_i, my_share - B_i if masked is None else masked
+    U01_me, V01_me = data_side(A01, B01) if role=="A" else dta_parts(True, E_share, A01, B01)
+    U10_me, V10_me = data_side(A10, B10) if role=="B" else dta_parts(True, E_share, A10, B10)
+    U01_pe, V01_pe, U10_pe, V10_pe = await exchange_vecs(
+        link, sid, TAG_CROSS, U01_me.ravel(), V01_me.ravel(), U10_me.ravel(), V10_me.ravel())
+
+    z01 = dta_finish_mat(role, U01_me + U01_pe.reshape(E_share.shape),
+                         V01_me + V01_pe.reshape(my_share.shape), A01, B01, C01)
+    z10 = dta_finish_mat(role, U10_me + U10_pe.reshape(E_share.shape),
+                         V10_me + V10_pe.reshape(my_share.shape), A10, B10, C10)
+    return z01 + z10
+
+# ---------- DPF queries ----------
+# Keys are expanded over the rows the client sent with them, a prefix of the
+# table: a resize reaches the parties one at a time, and both must expand the
+# same number of rows whatever their own table holds.
+def key_rows(n_bits, rows):
+    if rows > 1 << n_bits: raise RuntimeError("dpf key domain is smaller than its rows")
+    return rows
+
+# A read key is a DPF for the point function idx -> 1; its full-domain
+# expansion is this party's share of the selection vector e_idx.
+def expand_read_key(key, rows):
+    _, n_bits, w, *_ = dpf.parse_key(key)
+    if w != 1: raise RuntimeError("READ dpf key is not a selection key")
+    return dpf.eval_full(key, key_rows(n_bits, rows))[:, 0]
+
+# A write key is a DPF for idx -> delta whose output is a whole row (its final
+# correction word carries the payload); the expansion is this party's share of
+# delta placed at row idx.
+def expand_write_key(key, rows, width):
+    _, n_bits, w, *_ = dpf.parse_key(key)
+    if w != width: raise RuntimeError("WRITE dpf key does not match width")
+    return dpf.eval_full(key, key_rows(n_bits, rows))
+
+# An add key is a DPF for idx -> amount (one element); the expansion is this
+# party's share of amount placed in column field of row idx. Numeric fields
+# are single ring elements read as signed i64, so credits and debits are just
+# additions and need no read of the old value.
+def expand_field_key(key, rows, width, field):
+    _, n_bits, w, *_ = dpf.parse_key(key)
+    if w != 1: raise RuntimeError("ADD dpf key is not a single-element key")
+    if field >= width: raise RuntimeError("ADD field >= width")
+    col = dpf.eval_full(key, key_rows(n_bits, rows))
+    delta = np.zeros((len(col), width), dtype=col.dtype)
+    delta[:, field] = col[:, 0]
+    return delta
+
+# A transfer is a debit key (src -> -amount) and a credit key (dst -> amount)
+# applied as one write: one delta, one epoch, one log record, so no read ever
+# sees the money in neither or both accounts.
+def expand_transfer_keys(keys, rows, width, field):
+    debit, credit = (expand_field_key(key, rows, width, field) for key in keys)
+    if debit.shape != credit.shape: raise RuntimeError("TRANSFER keys cover different domains")
+    return debit + credit
+
+def transfer_payload(rows, field, keys): return pack_u32(rows) + pack_u32(field) + pack_u32(len(keys[0])) + keys[0] + keys[1]
+
+def parse_transfer_payload(payload):
+    rows, field, n = struct.unpack_from("!III", payload)
+    return rows, field, (payload[12:12+n], payload[12+n:])
+
+# ---------- recovery ----------
+# Bring the share up to the end of the log. A share store that was not closed
+# cleanly holds an unknown mix of writes, so it can only be rebuilt if the log
+# goes all the way back to an empty share.
+def replay_wal(share, wal):
+    if share.lsn is None:
+        if wal.base_lsn != 0:
+            raise RuntimeError("share store was not closed cleanly and the log does not reach back to an empty share")
+        share.data[:] = 0
+        share.lsn = 0
+    if share.lsn < wal.base_lsn or share.lsn > wal.lsn:
+        raise RuntimeError(f"share is at lsn {share.lsn}, log covers {wal.base_lsn}..{wal.lsn}")
+    n = 0
+    for lsn, kind, payload in wal.records(share.lsn):
+        if kind == KIND_VEC:   share.add(decode_vec(payload))
+        elif kind == KIND_DPF:
+            share.add(expand_write_key(payload[4:], struct.unpack_from("!I", payload)[0], share.data.shape[1]))
+        elif kind == KIND_RESIZE: share.resize(struct.unpack("!I", payload)[0])
+        elif kind == KIND_FIELD:
+            rows, field = struct.unpack_from("!II", payload)
+            share.add(expand_field_key(payload[8:], rows, share.data.shape[1], field))
+        elif kind == KIND_TRANSFER:
+            rows, field, keys = parse_transfer_payload(payload)
+            share.add(expand_transfer_keys(keys, rows, share.data.shape[1], field))
+        else: raise RuntimeError(f"log record {lsn}: unknown kind {kind}")
+        share.lsn = lsn
+        n += 1
+    return n
 
 # ---------- fetch correlated randomness ----------
-def fetch_share(share_host, share_port, dim):
-    s = connect(share_host, share_port)
-    s.sendall(pack_u8(OP_REQUEST))
-    s.sendall(pack_u32(dim))
-
-    op  = read_u8(s)
-    if op != OP_RESPONSE: raise RuntimeError("share server: bad op")
-    rdim = read_u32(s)
-    if rdim != dim: raise RuntimeError("share server: dim mismatch")
-    sid = read_i64(s)
-    a_i = [read_i64(s) for _ in range(dim)]
-    b_i = [read_i64(s) for _ in range(dim)]
-    c_i = read_i64(s)
-    s.close()
+# With rid=None the share server pairs us FIFO with the next request of the same
+# dim (legacy); otherwise it pairs us with the peer's request for the same rid.
+async def fetch_share(share_host, share_port, dim, rid=None):
+    r, w = await asyncio.open_connection(share_host, share_port)
+    try:
+        if rid is None:
+            w.write(pack_u8(OP_REQUEST) + pack_u32(dim))
+        else:
+            w.write(pack_u8(OP_REQUEST_RID) + pack_u32(dim) + pack_i64(rid))
+        await w.drain()
+
+        op  = await aread_u8(r)
+        if op != OP_RESPONSE: raise RuntimeError("share server: bad op")
+        rdim = await aread_u32(r)
+        if rdim != dim: raise RuntimeError("share server: dim mismatch")
+        sid = await aread_i64(r)
+        a_i = await aread_vec(r, dim)
+        b_i = await aread_vec(r, dim)
+        c_i = await aread_i64(r)
+    finally:
+        w.close()
     return sid, a_i, b_i, c_i
 
+async def fetch_batch_share(share_host, share_port, k, dim, width, rid):
+    r, w = await asyncio.open_connection(share_host, share_port)
+    try:
+        w.write(pack_u8(OP_REQUEST_BATCH) + pack_u32(k) + pack_u32(dim) + pack_u32(width) + pack_i64(rid))
+        await w.drain()
+
+        op = await aread_u8(r)
+        if op != OP_RESPONSE_BATCH: raise RuntimeError("share server: bad op")
+        shape = (await aread_u32(r), await aread_u32(r), await aread_u32(r))
+        if shape != (k, dim, width): raise RuntimeError("share server: shape mismatch")
+        sid = await aread_i64(r)
+        triples = []
+        for _ in range(2):
+            A_i = (await aread_vec(r, k*dim)).reshape(k, dim)
+            B_i = (await aread_vec(r, dim*width)).reshape(dim, width)
+            C_i = (await aread_vec(r, k*width)).reshape(k, width)
+            triples.append((A_i, B_i, C_i))
+    finally:
+        w.close()
+    return sid, triples
+
 # ---------- party service ----------
-def serve(role, rows, listen_host, listen_port,
+# The share is a rows x width matrix. OP_WRITE_VEC/OP_READ_SECURE/OP_READ_RID/
+# OP_READ_BATCH see it flattened row-major (rows*width elements, record i at
+# i*width..i*width+width-1); OP_READ_ROWS selects whole rows. OP_RESIZE grows
+# rows while requests keep running; a request sized for fewer rows acts on that
+# prefix of the table, so clients that have not asked OP_INFO yet still work.
+# With store=None the share lives in RAM and is lost on exit; otherwise it is
+# the memory-mapped share file at that path (see share_store.py). With a wal
+# path every write is logged and only acknowledged once the log is fsynced
+# (group commit every commit_ms), and the log is replayed on startup. restore
+# loads a snapshot into the share first; the log then continues from it.
+# With read_workers > 0 reads with a rid are served by that many forked
+# processes mapping the share file (see read_workers.py); a RAM share is then
+# kept in a file under /dev/shm for the lifetime of the server. threads splits
+# the products of one large read across that many cores (see ring.py). With
+# batch_ms > 0 reads with a rid arriving within batch_ms of each other (up to
+# batch_max of them) are computed together. admit, retry_ms and read_timeout: see
+# make_handler; backlog is the listen backlog for client connections. prefetch:
+# triples buffered per read shape (see triple_pool.py).
+def serve(role, rows, width, listen_host, listen_port,
           peer_listen_port, peer_host, peer_port,
-          share_host, share_port):
+          share_host, share_port, store=None, wal=None, commit_ms=2.0,
+          snapshot_dir=".", restore=None, read_workers=0, threads=1,
+          batch_ms=0.0, batch_max=64, admit=None, read_timeout=30.0, backlog=100, prefetch=0,
+          retry_ms=50):
+    set_threads(threads)
+    opts = dict(batch=(batch_ms / 1000, batch_max) if batch_ms > 0 else None,
+                admit=admit, retry_ms=retry_ms, read_timeout=read_timeout, prefetch=prefetch)
+    tmp = None
+    if read_workers and store is None:
+        tmp = tempfile.mkdtemp(prefix="duoram-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        store = os.path.join(tmp, "share")
+    A_share = RingShare(rows, width) if store is None else open_store(store, rows, width)
+    if restore is not None:
+        A_share.restore(*load_npy(restore))
+        print(f"[{role}] restored {restore} at lsn {A_share.lsn}")
+    log = None
+    if wal is not None:
+        log = WriteAheadLog(wal, commit_ms / 1000)
+        print(f"[{role}] replayed {replay_wal(A_share, log)} logged writes, at lsn {A_share.lsn}")
+    elif A_share.lsn is None:
+        A_share.lsn = 0  # no log to recover from: take the file as it is
+    A_share.mark_dirty()
+    workers = version = None
+    if read_workers:
+        version = SharedVersion()
+        workers = ReadWorkers(read_workers, role, store, ROUTED_OPS, listen_host,
+                              peer_listen_port, peer_host, peer_port,
+                              lambda share, link: make_handler(role, share, None, None, link, share_host, share_port,
+                                                                 premask=False, version=version, worker=True, **opts))
+        workers.start()
+    try:
+        asyncio.run(serve_async(role, A_share, log, Snapshotter(snapshot_dir), workers, version, opts, backlog,
+                                listen_host, listen_port,
+                                peer_listen_port, peer_host, peer_port,
+                                share_host, share_port))
+    finally:
+        if workers is not None: workers.stop()
+        if log is not None: log.close()
+        A_share.mark_clean()
+        if tmp is not None: shutil.rmtree(tmp)
 
-    A_share = [0]*rows  # local RAM share
+# The request handler for one party process. A read worker (see read_workers.py)
+# builds its own over a read-only map of the share, with no log or snapshots.
+# batch=(window seconds, max reads) turns on micro-batching (see read_batcher.py);
+# admit=(max in flight, max queued, max per client) turns on admission control
+# (see admission.py). A decides which reads to admit and B follows its aborts,
+# so the parties never run different sets of reads. Every read with a rid is
+# given up after read_timeout seconds. A read turned away, given up or aborted
+# is answered BUSY with a retry hint of retry_ms (at least 1). prefetch > 0 keeps that many
+# triples per read shape fetched ahead (see triple_pool.py), and with premask
+# their data-side residuals computed ahead too (see premask.py); a read worker
+# sees no writes and cannot keep those up to date. version is the epoch the
+# owner publishes for its read workers (see read_workers.py); worker=True
+# builds a worker's handler, which reads copies of the share at that epoch.
+def make_handler(role, A_share, log, snapshots, link, share_host, share_port, batch=None,
+                 admit=None, retry_ms=50, read_timeout=30.0, prefetch=0, premask=True, version=None, worker=False):
+    # OP_READ_SECURE carries no request id, so both parties can only pair those
+    # reads up by arrival order: keep them one at a time, as before.
+    legacy_reads = asyncio.Lock()
+    legacy_writes = itertools.count(1)  # OP_WRITE_VEC n gets wid -n
+    epochs = Epochs(A_share, A_share.lsn or 0, None if worker else version, read_timeout)
+    order = WriteOrder(role, link, epochs, read_timeout)
 
-    # acceptor for residuals
-    res_ls = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    res_ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    res_ls.bind((listen_host, peer_listen_port))
-    res_ls.listen()
+    async def log_write(kind, payload):
+        if log is None: return
+        A_share.lsn = log.append(kind, payload)
+        await log.durable(A_share.lsn)
 
-    # acceptor for user requests
-    user_ls = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    user_ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    user_ls.bind((listen_host, listen_port))
-    user_ls.listen()
+    # The epoch a read uses, agreed with the peer -> (epoch, the peer's sid, at)
+    # where at() is this party's share as of that epoch: call it right before
+    # using it, with no await in between. The epoch stays pinned until then
+    # (see epochs.py), however long the triple takes. A read worker has no undo history: the
+    # two workers agree on the later of the epochs the owners published, copy
+    # the share at that epoch or later, and go on until their copies are of the
+    # same epoch. After EPOCH_ROUNDS copies (or a copy a write kept landing in,
+    # see read_workers.py) the read gives up with EpochGone.
+    async def agree_version(key, sid=0):
+        if not worker:
+            order.check()
+            e, peer_sid = await agree_epoch(link, key, epochs.epoch, sid)
+            token = epochs.pin(e)
+            return e, peer_sid, lambda: epochs.at(e, token)
+        version.check()
+        data, mine = None, version.epoch()
+        for attempt in range(EPOCH_ROUNDS + 1):
+            theirs, peer_sid = await exchange_epoch(link, key ^ attempt, mine, sid)
+            if data is not None and theirs == mine: return mine, peer_sid, lambda: data
+            data = None  # one copy of the share at a time
+            if attempt < EPOCH_ROUNDS: data, mine = await version.copy(A_share, max(mine, theirs))
+        raise EpochGone(f"read workers did not copy the same epoch in {EPOCH_ROUNDS} rounds")
+
+    # Reads with a rid agree on the epoch while the triple is being fetched;
+    # legacy reads only have the sid. From taking the version of the share to
+    # sending the residuals (the start of dta_cross_*) nothing awaits.
+    async def secure_read(e_share, rid):
+        dim = len(e_share)
+        if rid is None:
+            sid, a_i, b_i, c_i = await fetch_share(share_host, share_port, dim)
+            _, _, at = await agree_version(sid)
+        else:
+            (sid, a_i, b_i, c_i), (_, _, at) = await asyncio.gather(
+                fetch_share(share_host, share_port, dim, rid), agree_version(rid))
+
+        my_share = at().reshape(-1)[:dim]
+        self_term = ring_dot(my_share, e_share)
+        cross = await dta_cross_fused(role, link, sid, my_share, e_share, a_i, b_i, c_i)
+        return to_i64(self_term + cross)
+
+    def fetch(shape, rid): return fetch_batch_share(share_host, share_port, *shape, rid)
+
+    # Prefetched triples come with this party's data-side residual already
+    # computed; R for a (k, dim, width) triple is the first dim*width elements
+    # of the flattened share, which is what both read views take.
+    masks = Premasks() if premask else None
+    def prepare(shape, triples):
+        _, dim, width = shape
+        R = A_share.data.reshape(-1)[:dim*width].reshape(dim, width)
+        return masks.make(R, triples[0 if role == "A" else 1][1])
+    pool = None if not prefetch else TriplePool(role, link, fetch, prefetch, read_timeout,
+                                                prepare=prepare if premask else None)
+
+    # Write wid in its turn (see write_order.py), with no await from adding the
+    # delta to the share (through the snapshotter, see snapshot.py) to counting
+    # the epoch and bringing the masks up to date.
+    async def apply_write(wid, delta, undo):
+        await order.turn(wid)
+        if version is not None: version.begin()
+        snapshots.add(A_share, delta, undo)
+        epochs.applied(undo)
+        if masks is not None: masks.applied(delta)
+        order.applied(wid)
 
-    while True:
-        conn, _ = user_ls.accept()
+    # The triple for a read: a prefetched one if A has one buffered (B draws
+    # the same), otherwise fetched now by the read's rid on both parties.
+    # -> ((sid, triples, mask or None), agreed epoch, at) as in agree_version
+    async def triple_and_epoch(shape, rid):
+        if pool is None:
+            (sid, triples), (e, _, at) = await asyncio.gather(fetch(shape, rid), agree_version(rid))
+            return (sid, triples, None), e, at
+        got = pool.take(shape) if role == "A" else None
+        e, peer_sid, at = await agree_version(rid, got[0] if got else 0)
+        if role == "B" and peer_sid: got = (peer_sid, *await pool.draw(peer_sid))
+        return got or (*await fetch(shape, rid), None), e, at
+
+    # E_share (k x dim) times R (dim x width), R = view(share as of the agreed epoch)
+    async def batch_read(E_share, view, width, rid):
+        (sid, triples, mask), e, at = await triple_and_epoch((*E_share.shape, width), rid)
+
+        R_me = view(at())
+        masked = masks.take(mask, e == epochs.epoch) if mask is not None else None
+        self_term = ring_matmul(E_share, R_me)
+        cross = await dta_cross_batch(role, link, sid, R_me, E_share, triples, masked)
+        return self_term + cross
+
+    # Overwrite the row e selects with new, given this party's shares of both,
+    # without anyone learning the old value: old = e·R as in a row read, then
+    # the delta is e ⊗ (new - old), whose cross terms take a second (rows x 1
+    # by 1 x width) triple. A write applied in between, which the read did not
+    # see, stays on top of the new value. -> this party's share of the delta
+    #
+    # Only the first phase (the read and the second triple) can time out, and a
+    # party that gives up there aborts the overwrite at the peer (which then
+    # drops it too) before sending its last residuals. Once a party has sent
+    # them the peer can finish, so neither gives up after that: the two parties
+    # apply the delta both or neither.
+    async def overwrite(e_share, new_share, rid):
+        async def first():
+            old = (await run_read(e_share.reshape(1, -1), ROWS, rid))[0]
+            return old, *await fetch((len(e_share), 1, len(new_share)), rid ^ (1 << 62))
+        old, sid, triples = await asyncio.wait_for(first(), read_timeout)
+        E, D = e_share.reshape(-1, 1), (new_share - old).reshape(1, -1)
+        return ring_matmul(E, D) + await dta_cross_batch(role, link, sid, D, E, triples)
+
+    # E_share times the flattened share (FLAT) or the rows of the share (ROWS)
+    async def run_read(E_share, kind, rid):
+        dim = E_share.shape[1]
+        if kind == FLAT: return await batch_read(E_share, lambda d: d.reshape(-1)[:dim].reshape(-1, 1), 1, rid)
+        return await batch_read(E_share, lambda d: d[:dim], A_share.data.shape[1], rid)
+
+    batcher = None if batch is None else ReadBatcher(role, link, *batch, run_read, read_timeout)
+    retry_ms = max(1, retry_ms)
+    admission = Admission(*admit, retry_ms) if admit is not None and role == "A" else None
+    active = {}                          # rid -> task computing that read
+    aborted = collections.OrderedDict()  # recent rids the peer gave up on -> retry ms
+    tasks = set()
+
+    def abort_peer(rid, retry):
+        task = asyncio.create_task(link.send(rid, TAG_ABORT, pack_u32(retry)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def on_abort(rid, body):
+        aborted[rid] = struct.unpack("!I", body)[0]
+        if len(aborted) > 4096: aborted.popitem(last=False)
+        task = active.get(rid)
+        if task is not None: task.cancel()
+        if batcher is not None: batcher.drop(rid)
+    link.handlers[TAG_ABORT] = on_abort
+    link.ttl = 2 * read_timeout  # a frame for a read is claimed within its timeout or never
+
+    def busy(retry): return pack_u8(READ_BUSY) + pack_u32(retry)
+    def error(msg): return pack_u8(READ_ERROR) + pack_u32(len(msg)) + msg
+
+    # reply for read rid: READ_OK + work(), or READ_BUSY if it is not admitted,
+    # times out, finds its epoch gone or is aborted by the peer
+    async def guarded(rid, client, work):
+        if rid in aborted: return busy(aborted[rid])
+        if admission is not None:
+            try:
+                await asyncio.wait_for(admission.enter(client), read_timeout)
+            except (Busy, asyncio.TimeoutError):
+                abort_peer(rid, retry_ms)
+                return busy(retry_ms)
+        task = asyncio.ensure_future(asyncio.wait_for(work(), read_timeout))
+        active[rid] = task
         try:
-            op = read_u8(conn)
+            return pack_u8(READ_OK) + await task
+        except (asyncio.TimeoutError, EpochGone):
+            abort_peer(rid, retry_ms)
+            return busy(retry_ms)
+        except asyncio.CancelledError:
+            if rid not in aborted: raise
+            return busy(aborted[rid])
+        finally:
+            active.pop(rid, None)
+            if admission is not None: admission.leave(client)
+
+    async def rid_read(e_share, rid):
+        if batcher is None and pool is None: return pack_i64(await secure_read(e_share, rid))
+        return pack_i64(to_i64((await read(e_share.reshape(1, -1), FLAT, rid))[0, 0]))
+
+    async def flat_read(E_share, rid):
+        return encode_vec((await read(E_share, FLAT, rid)).ravel())
+
+    async def rows_read(E_share, rid):
+        out = await read(E_share, ROWS, rid)
+        return pack_u32(out.shape[1]) + encode_vec(out.ravel())
+
+    # Sums and public weights are local to each party's share: the parties only
+    # agree on the epoch so both sum the same version, no triple is involved.
+    async def aggregate(mode, weights, rid):
+        if mode == AGG_SHARED: return await rows_read(weights.reshape(1, -1), rid)
+        if mode not in (AGG_SUM, AGG_PUBLIC): raise RuntimeError(f"AGGREGATE unknown mode {mode}")
+        _, _, at = await agree_version(rid)
+        R = at()
+        out = R.sum(axis=0, dtype=RING_DTYPE) if mode == AGG_SUM else ring_matmul(weights, R[:len(weights)])
+        return pack_u32(len(out)) + encode_vec(out)
+
+    async def read(E_share, kind, rid):
+        if batcher is None: return await run_read(E_share, kind, rid)
+        return await batcher.read(rid, kind, E_share)
+
+    # A read with a rid that fails here (a bad request, an epoch out of reach)
+    # is answered READ_ERROR and aborted at the peer, which would otherwise wait
+    # for it until read_timeout.
+    async def handle_user(r, w):
+        client = (w.get_extra_info("peername") or ("?",))[0]
+        op = rid = None
+        try:
+            op = await aread_u8(r)
+
+            if op in (OP_WRITE_VEC, OP_WRITE_VEC_WID):
+                wid = await aread_i64(r) if op == OP_WRITE_VEC_WID else None
+                dim = await aread_u32(r)
+                if dim > A_share.data.size: raise RuntimeError("WRITE dim > rows*width")
+                vec = await aread_vec(r, dim)
+                if wid is None: wid = -next(legacy_writes)
+                await apply_write(wid, vec, lambda: vec)
+                print(f"[{role}] WRITE {vec.view(np.int64)} -> {role}_share now {A_share.flat.view(np.int64)}")
+                await log_write(KIND_VEC, encode_vec(vec))
+                w.write(b"OK")
+
+            elif op == OP_WRITE_DPF:
+                wid = await aread_i64(r)
+                rows = await aread_u32(r)
+                if rows > len(A_share.data): raise RuntimeError("WRITE rows > table rows")
+                key = await r.readexactly(await aread_u32(r))
+                width = A_share.data.shape[1]
+                delta = expand_write_key(key, rows, width)
+                await apply_write(wid, delta, lambda: expand_write_key(key, rows, width))
+                print(f"[{role}] WRITE_DPF ({len(key)} byte key) -> {role}_share now {A_share.flat.view(np.int64)}")
+                await log_write(KIND_DPF, pack_u32(rows) + key)
+                w.write(b"OK")
 
-            if op == OP_WRITE_VEC:
-                dim = read_u32(conn)
-                if dim != rows: raise RuntimeError("WRITE dim != rows")
-                vec = [read_i64(conn) for _ in range(dim)]
-                for i in range(rows): A_share[i] += vec[i]
-                print(f"[{role}] WRITE {vec} -> {role}_share now {A_share}")
-                conn.sendall(b"OK")
+            elif op == OP_ADD_DPF:
+                wid = await aread_i64(r)
+                rows = await aread_u32(r)
+                if rows > len(A_share.data): raise RuntimeError("ADD rows > table rows")
+                field = await aread_u32(r)
+                key = await r.readexactly(await aread_u32(r))
+                width = A_share.data.shape[1]
+                delta = expand_field_key(key, rows, width, field)
+                await apply_write(wid, delta, lambda: expand_field_key(key, rows, width, field))
+                print(f"[{role}] ADD_DPF field {field} ({len(key)} byte key)")
+                await log_write(KIND_FIELD, pack_u32(rows) + pack_u32(field) + key)
+                w.write(b"OK")
+
+            elif op == OP_TRANSFER_DPF:
+                wid = await aread_i64(r)
+                rows = await aread_u32(r)
+                if rows > len(A_share.data): raise RuntimeError("TRANSFER rows > table rows")
+                field = await aread_u32(r)
+                keys = [await r.readexactly(await aread_u32(r)) for _ in range(2)]
+                width = A_share.data.shape[1]
+                delta = expand_transfer_keys(keys, rows, width, field)
+                await apply_write(wid, delta, lambda: expand_transfer_keys(keys, rows, width, field))
+                print(f"[{role}] TRANSFER_DPF field {field} ({len(keys[0])}+{len(keys[1])} byte keys)")
+                await log_write(KIND_TRANSFER, transfer_payload(rows, field, keys))
+                w.write(b"OK")
+
+            elif op == OP_OVERWRITE_DPF:
+                rid = await aread_i64(r)
+                rows = await aread_u32(r)
+                if rows > len(A_share.data): raise RuntimeError("OVERWRITE rows > table rows")
+                key = await r.readexactly(await aread_u32(r))
+                width = await aread_u32(r)
+                if width != A_share.data.shape[1]: raise RuntimeError("OVERWRITE width does not match")
+                new_share = await aread_vec(r, width)
+                e_share = expand_read_key(key, rows)
+                if rid in aborted: raise RuntimeError("OVERWRITE aborted by the peer")
+                task = active[rid] = asyncio.ensure_future(overwrite(e_share, new_share, rid))
+                try:
+                    delta = await task
+                except asyncio.CancelledError:
+                    if rid not in aborted: raise
+                    raise RuntimeError("OVERWRITE aborted by the peer")
+                finally:
+                    active.pop(rid, None)
+                await apply_write(rid, delta, lambda: delta)
+                print(f"[{role}] OVERWRITE_DPF ({len(key)} byte key) -> {role}_share now {A_share.flat.view(np.int64)}")
+                await log_write(KIND_VEC, encode_vec(delta.ravel()))
+                w.write(b"OK")
 
             elif op == OP_READ_SECURE:
-                dim = read_u32(conn)
-                if dim != rows: raise RuntimeError("READ dim != rows")
-                e_share = [read_i64(conn) for _ in range(dim)]
-
-                sid, a_i, b_i, c_i = fetch_share(share_host, share_port, dim)
-
-                z01 = dta_cross(role, res_ls, peer_host, peer_port, sid, 0x01,
-                                i_am_X_side=(role=="A"),
-                                my_input=(A_share if role=="A" else e_share),
-                                a_i=a_i, b_i=b_i, c_i=c_i)
-                z10 = dta_cross(role, res_ls, peer_host, peer_port, sid, 0x10,
-                                i_am_X_side=(role=="B"),
-                                my_input=(A_share if role=="B" else e_share),
-                                a_i=a_i, b_i=b_i, c_i=c_i)
-
-                self_term = dot(A_share, e_share)
-                my_share  = self_term + z01 + z10
-                conn.sendall(pack_i64(my_share))
+                dim = await aread_u32(r)
+                if dim > A_share.data.size: raise RuntimeError("READ dim > rows*width")
+                e_share = await aread_vec(r, dim)
+                async with legacy_reads:
+                    my_share = await secure_read(e_share, None)
+                w.write(pack_i64(my_share))
+
+            elif op == OP_READ_RID:
+                rid = await aread_i64(r)
+                dim = await aread_u32(r)
+                if dim > A_share.data.size: raise RuntimeError("READ dim > rows*width")
+                e_share = await aread_vec(r, dim)
+                w.write(await guarded(rid, client, lambda: rid_read(e_share, rid)))
+
+            elif op == OP_READ_BATCH:
+                rid = await aread_i64(r)
+                dim = await aread_u32(r)
+                k   = await aread_u32(r)
+                if dim > A_share.data.size: raise RuntimeError("READ dim > rows*width")
+                E_share = (await aread_vec(r, k*dim)).reshape(k, dim)
+                w.write(await guarded(rid, client, lambda: flat_read(E_share, rid)))
+
+            elif op == OP_READ_ROWS:
+                rid = await aread_i64(r)
+                dim = await aread_u32(r)
+                k   = await aread_u32(r)
+                if dim > len(A_share.data): raise RuntimeError("READ dim > rows")
+                E_share = (await aread_vec(r, k*dim)).reshape(k, dim)
+                w.write(await guarded(rid, client, lambda: rows_read(E_share, rid)))
+
+            elif op == OP_READ_DPF:
+                rid = await aread_i64(r)
+                rows = await aread_u32(r)
+                k   = await aread_u32(r)
+                if rows > len(A_share.data): raise RuntimeError("READ rows > table rows")
+                keys = [await r.readexactly(await aread_u32(r)) for _ in range(k)]
+                E_share = np.stack([expand_read_key(key, rows) for key in keys])
+                w.write(await guarded(rid, client, lambda: rows_read(E_share, rid)))
+
+            elif op == OP_AGGREGATE:
+                rid  = await aread_i64(r)
+                mode = await aread_u8(r)
+                n    = await aread_u32(r)
+                if n > len(A_share.data): raise RuntimeError("AGGREGATE n > rows")
+                if mode == AGG_SUM and n: raise RuntimeError("AGGREGATE sum takes no weights")
+                weights = await aread_vec(r, n)
+                w.write(await guarded(rid, client, lambda: aggregate(mode, weights, rid)))
+
+            elif op == OP_SNAPSHOT:
+                name = (await r.readexactly(await aread_u32(r))).decode()
+                snapshots.start(A_share, name)
+                print(f"[{role}] SNAPSHOT {name} at lsn {A_share.lsn} started")
+                w.write(b"OK")
+
+            elif op == OP_SNAPSHOT_STATUS:
+                state, done, total = snapshots.poll()
+                w.write(pack_u8(state) + pack_i64(done) + pack_i64(total))
+
+            elif op == OP_RESIZE:
+                rows = await aread_u32(r)
+                old = len(A_share.data)
+                A_share.resize(rows)
+                if len(A_share.data) != old:
+                    print(f"[{role}] RESIZE {old} -> {len(A_share.data)} rows")
+                    await log_write(KIND_RESIZE, pack_u32(len(A_share.data)))
+                w.write(pack_u32(len(A_share.data)))
+
+            elif op == OP_INFO:
+                w.write(pack_u32(len(A_share.data)) + pack_u32(A_share.data.shape[1]))
+
+            await w.drain()
+        except asyncio.IncompleteReadError:
+            if op in ABORTABLE_OPS and rid is not None: abort_peer(rid, retry_ms)
+        except Exception as e:
+            print(f"[{role}] request failed: {type(e).__name__}: {e}")
+            if op in ABORTABLE_OPS and rid is not None: abort_peer(rid, retry_ms)
+            if op in ROUTED_OPS and rid is not None: w.write(error(f"{type(e).__name__}: {e}".encode()))
         finally:
-            conn.close()
+            w.close()
+
+    return handle_user
+
+async def serve_async(role, A_share, log, snapshots, workers, version, opts, backlog, listen_host, listen_port,
+                      peer_listen_port, peer_host, peer_port,
+                      share_host, share_port):
+    # persistent link to the peer (residuals)
+    link = PeerLink(role, listen_host, peer_listen_port, peer_host, peer_port)
+    await link.start()
+    handle_user = make_handler(role, A_share, log, snapshots, link, share_host, share_port,
+                               version=version, **opts)
+
+    # SIGTERM stops the server cleanly (log synced, share store marked clean)
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+
+    # acceptor for user requests
+    if workers is None:
+        user_srv = await asyncio.start_server(
+            handle_user, listen_host, listen_port, reuse_address=True, backlog=backlog)
+        async with user_srv:
+            await stop.wait()
+    else:
+        accept = asyncio.create_task(workers.accept(
+            listen_host, listen_port, backlog, handle_user, lambda: len(A_share.data)))
+        await stop.wait()
+        accept.cancel()
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--role", required=True, choices=["A","B"])
     ap.add_argument("--rows", type=int, required=True)
+    ap.add_argument("--width", type=int, default=STR_SIZE)
     ap.add_argument("--listen", default="0.0.0.0:9700")
     ap.add_argument("--peer-listen", type=int, default=9701)
     ap.add_argument("--peer", default="127.0.0.1:9801")
     ap.add_argument("--share", default="127.0.0.1:9300")
+    ap.add_argument("--store", default=None)
+    ap.add_argument("--wal", default=None)
+    ap.add_argument("--commit-window-ms", type=float, default=2.0)
+    ap.add_argument("--snapshot-dir", default=".")
+    ap.add_argument("--restore", default=None)
+    ap.add_argument("--read-workers", type=int, default=0)
+    ap.add_argument("--threads", type=int, default=1)
+    ap.add_argument("--batch-window-ms", type=float, default=0.0)
+    ap.add_argument("--batch-max", type=int, default=64)
+    ap.add_argument("--max-inflight", type=int, default=0)
+    ap.add_argument("--max-queue", type=int, default=64)
+    ap.add_argument("--max-per-client", type=int, default=0)
+    ap.add_argument("--retry-after-ms", type=int, default=50)
+    ap.add_argument("--read-timeout", type=float, default=30.0)
+    ap.add_argument("--backlog", type=int, default=100)
+    ap.add_argument("--prefetch", type=int, default=0)
     args = ap.parse_args()
 
     lh, lp = args.listen.split(":")[0], int(args.listen.split(":")[1])
     ph, pp = args.peer.split(":")[0],   int(args.peer.split(":")[1])
     sh, sp = args.share.split(":")[0],  int(args.share.split(":")[1])
 
-    serve(args.role, args.rows, lh, lp, args.peer_listen, ph, pp, sh, sp)
+    serve(args.role, args.rows, args.width, lh, lp, args.peer_listen, ph, pp, sh, sp,
+          args.store, args.wal, args.commit_window_ms, args.snapshot_dir, args.restore,
+          args.read_workers, args.threads, args.batch_window_ms, args.batch_max,
+          (args.max_inflight, args.max_queue, args.max_per_client) if args.max_inflight else None,
+          args.read_timeout, args.backlog, args.prefetch, args.retry_after_ms)
 
 if __name__ == "__main__":
     main()
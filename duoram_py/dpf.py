@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import hashlib, os, struct
+import numpy as np
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from ring import RING_DTYPE, to_ring
+
+# Two-party distributed point function (Boyle-Gilboa-Ishai tree construction).
+# gen(alpha, beta, n_bits) splits the point function f(alpha) = beta, f(x) = 0
+# elsewhere, over the domain [0, 2^n_bits), into two keys of O(n_bits) bytes;
+# eval_full(key_b, size) expands key b over [0, size) and the two expansions
+# add up to f in Z/2^64. beta may be a vector (width w), giving a size x w
+# result, so the same keys select a row for a read or carry a row for a write.
+#
+# The PRG is fixed-key AES in Matyas-Meyer-Oseas mode, G_k(s) = AES_k(s) ^ s.
+# Every tree level is one AES-ECB call over all seeds of that level.
+SEED_BYTES = 16
+KEY_HDR = struct.Struct("!BBI")  # [party:u8][n_bits:u8][width:u32]
+
+def _fixed_key(label): return hashlib.sha256(b"duoram-dpf-" + label).digest()[:16]
+AES_L, AES_R, AES_CONV = _fixed_key(b"L"), _fixed_key(b"R"), _fixed_key(b"convert")
+
+def _mmo(key, S):
+    enc = Cipher(algorithms.AES(key), modes.ECB()).encryptor()
+    out = np.frombuffer(enc.update(S.tobytes()), dtype=np.uint8).reshape(S.shape)
+    return out ^ S
+
+# one tree level: seeds (m x 16) -> left/right child seeds and control bits
+def _expand(S):
+    SL, SR = _mmo(AES_L, S), _mmo(AES_R, S)
+    TL, TR = SL[:, 0] & 1, SR[:, 0] & 1
+    SL[:, 0] &= 0xFE; SR[:, 0] &= 0xFE
+    return SL, TL, SR, TR
+
+# seeds (m x 16) -> m x w pseudo-random ring elements
+def _convert(S, w):
+    blocks = []
+    for j in range((w + 1) // 2):
+        X = S.copy(); X[:, -1] ^= j
+        blocks.append(_mmo(AES_CONV, X).view("<u8").astype(RING_DTYPE))
+    return np.concatenate(blocks, axis=1)[:, :w]
+
+def domain_bits(size): return max(1, (size - 1).bit_length())
+
+def gen(alpha, beta, n_bits):
+    beta = to_ring(beta)
+    w = len(beta)
+    if not 0 <= alpha < (1 << n_bits): raise ValueError("alpha outside the DPF domain")
+
+    root = [np.frombuffer(os.urandom(SEED_BYTES), dtype=np.uint8).reshape(1, SEED_BYTES) for _ in range(2)]
+    s, t = list(root), [0, 1]
+    cws = []
+    for i in range(n_bits):
+        a = (alpha >> (n_bits - 1 - i)) & 1
+        (sL0, tL0, sR0, tR0), (sL1, tL1, sR1, tR1) = _expand(s[0]), _expand(s[1])
+        s_cw  = (sL0 ^ sL1) if a else (sR0 ^ sR1)  # lose side
+        tL_cw = int(tL0[0] ^ tL1[0]) ^ a ^ 1
+        tR_cw = int(tR0[0] ^ tR1[0]) ^ a
+        cws.append((s_cw, tL_cw, tR_cw))
+        for b, (sL, tL, sR, tR) in enumerate(((sL0, tL0, sR0, tR0), (sL1, tL1, sR1, tR1))):
+            s_keep, t_keep, t_keep_cw = (sR, tR, tR_cw) if a else (sL, tL, tL_cw)
+            s[b] = s_keep ^ s_cw if t[b] else s_keep
+            t[b] = int(t_keep[0]) ^ (t[b] & t_keep_cw)
+
+    final = beta - _convert(s[0], w)[0] + _convert(s[1], w)[0]
+    if t[1]: final = -final
+
+    body = b"".join(cw.tobytes() + bytes([tL << 1 | tR]) for cw, tL, tR in cws)
+    body += final.astype(">u8").tobytes()
+    return tuple(KEY_HDR.pack(b, n_bits, w) + root[b].tobytes() + body for b in range(2))
+
+def parse_key(key):
+    b, n_bits, w = KEY_HDR.unpack_from(key, 0)
+    if len(key) != key_size(n_bits, w): raise ValueError("malformed DPF key")
+    off = KEY_HDR.size
+    seed = np.frombuffer(key, dtype=np.uint8, count=SEED_BYTES, offset=off).reshape(1, SEED_BYTES)
+    off += SEED_BYTES
+    cws = []
+    for _ in range(n_bits):
+        cw = np.frombuffer(key, dtype=np.uint8, count=SEED_BYTES, offset=off)
+        tbits = key[off + SEED_BYTES]
+        cws.append((cw, tbits >> 1 & 1, tbits & 1))
+        off += SEED_BYTES + 1
+    final = np.frombuffer(key, dtype=">u8", count=w, offset=off).astype(RING_DTYPE)
+    return b, n_bits, w, seed, cws, final
+
+def key_size(n_bits, w): return KEY_HDR.size + SEED_BYTES + n_bits*(SEED_BYTES + 1) + 8*w
+
+# Full-domain evaluation, level by level; nodes whose subtree lies entirely
+# beyond size are dropped as soon as they appear.
+def eval_full(key, size):
+    b, n_bits, w, seed, cws, final = parse_key(key)
+    if size > (1 << n_bits): raise ValueError("size exceeds the DPF domain")
+    S, T = seed, np.array([b], dtype=np.uint8)
+    for level, (s_cw, tL_cw, tR_cw) in enumerate(cws):
+        SL, TL, SR, TR = _expand(S)
+        on = T.astype(bool)
+        SL[on] ^= s_cw; SR[on] ^= s_cw
+        TL ^= T & tL_cw; TR ^= T & tR_cw
+        keep = -(-size >> (n_bits - level - 1))
+        S = np.stack([SL, SR], axis=1).reshape(-1, SEED_BYTES)[:keep]
+        T = np.stack([TL, TR], axis=1).reshape(-1)[:keep]
+    out = _convert(S, w) + T.astype(RING_DTYPE)[:, None] * final
+    return -out if b else out
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import collections, itertools, time
+import numpy as np
+
+# Epochs: versions of a party's share, so a read sees one version while writes
+# keep arriving.
+#
+# Writes are applied in place as before; each one starts a new epoch and leaves
+# an undo record (a function returning the flat delta it added). Version e of
+# the share is the current share minus the deltas of the writes after e, which
+# the ring makes exact. A read agrees on e with the peer (the smaller of the
+# two parties' epochs when the read starts, so both have applied the same
+# writes), then takes version e and does everything that touches the share in
+# one step with no await in between: no write can land in the middle, and
+# neither side ever waits for the other.
+#
+# Epochs count writes, so both parties must apply the same writes in the same
+# order, whichever client sent them: B follows the order A numbers them in
+# (see write_order.py).
+#
+# The last HISTORY writes can always be undone. A read pins the epoch it agreed
+# on until it takes that version (the triple may still be on the way), and
+# the writes after a pinned epoch are kept too, for at most `keep` seconds. A
+# read whose epoch is gone anyway (a peer far behind) fails with EpochGone and
+# can be retried.
+HISTORY = 32
+
+class EpochGone(RuntimeError):
+    pass
+
+# version, if given, is where the epoch is published for read workers (see
+# SharedVersion in read_workers.py).
+class Epochs:
+    def __init__(self, share, epoch=0, version=None, keep=30.0):
+        self.share = share
+        self.epoch = epoch
+        self.undo = collections.deque()
+        self.version = version
+        self.keep = keep
+        self.pins = {}  # token -> (deadline, epoch)
+        self.tokens = itertools.count()
+        self._publish()
+
+    def _publish(self):
+        if self.version is not None: self.version.end(self.epoch)
+
+    # call right after applying a write, before any await
+    def applied(self, delta):
+        self.epoch += 1
+        self.undo.append(delta)
+        self._trim()
+        self._publish()
+
+    # keep version e readable until at(e, token) -> token
+    def pin(self, e):
+        self._check(e)
+        token = next(self.tokens)
+        self.pins[token] = (time.monotonic() + self.keep, e)
+        return token
+
+    def _trim(self):
+        now = time.monotonic()
+        for token in [t for t, (deadline, _) in self.pins.items() if deadline < now]: del self.pins[token]
+        oldest = min((e for _, e in self.pins.values()), default=self.epoch)
+        # undo[0] is the write that reached epoch - len(undo) + 1
+        while len(self.undo) > HISTORY and self.epoch - len(self.undo) + 1 <= oldest: self.undo.popleft()
+
+    def _check(self, e):
+        back = self.epoch - e
+        if back < 0 or back > len(self.undo):
+            raise EpochGone(f"epoch {e} is not available (at {self.epoch}, {len(self.undo)} writes kept)")
+
+    # continue the numbering at e; earlier versions can no longer be read
+    def rebase(self, e):
+        if e != self.epoch: self.undo.clear()
+        self.epoch = e
+        self._publish()
+
+    # the share as of epoch e: the share itself, or a copy with later writes
+    # undone; token releases the pin on e
+    def at(self, e, token=None):
+        self.pins.pop(token, None)
+        self._check(e)
+        back = self.epoch - e
+        if back == 0: return self.share.data
+        data = np.array(self.share.data)
+        flat = data.reshape(-1)
+        for delta in list(self.undo)[len(self.undo) - back:]:
+            d = delta().reshape(-1)
+            flat[:len(d)] -= d
+        return data
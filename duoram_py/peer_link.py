@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import asyncio, collections, struct
+
+# One long-lived, full-duplex TCP connection between parties A and B.
+# A dials B's peer-listen port (and redials if the link drops); B accepts.
+# Every frame is [sid:i64][tag:u8][len:u32][body:len] and is handed to whoever
+# waits on (sid, tag), so any number of reads can share the link; frames of a
+# tag with a handler (frames nobody asks for) go to handler(sid, body) instead.
+# A frame nobody claims within ttl seconds (its read was aborted or given up
+# here) is dropped.
+FRAME_HDR = struct.Struct("!qBI")
+
+class PeerLink:
+    def __init__(self, role, listen_host, listen_port, peer_host, peer_port, ttl=60.0):
+        self.role, self.ttl = role, ttl
+        self.listen_host, self.listen_port = listen_host, listen_port
+        self.peer_host, self.peer_port = peer_host, peer_port
+        self.slots = {}
+        self.unclaimed = collections.OrderedDict()  # (sid, tag) -> arrival time of a frame nobody waits for
+        self.handlers = {}
+        self.w = None
+        self.up = asyncio.Event()
+        self.srv = None
+        self.dialer = None
+
+    async def start(self):
+        if self.role == "A":
+            self.dialer = asyncio.create_task(self._dial())
+        else:
+            self.srv = await asyncio.start_server(
+                self._run, self.listen_host, self.listen_port, reuse_address=True)
+
+    async def _dial(self):
+        while True:
+            try:
+                r, w = await asyncio.open_connection(self.peer_host, self.peer_port)
+            except OSError:
+                await asyncio.sleep(0.5)
+                continue
+            await self._run(r, w)
+
+    async def _run(self, r, w):
+        if self.w is not None: self.w.close()
+        self.w = w
+        self.up.set()
+        print(f"[{self.role}] peer link up")
+        try:
+            while True:
+                sid, tag, n = FRAME_HDR.unpack(await r.readexactly(FRAME_HDR.size))
+                body = await r.readexactly(n)
+                if tag in self.handlers:
+                    self.handlers[tag](sid, body)
+                    continue
+                self._expire()
+                if (sid, tag) not in self.slots: self.unclaimed[(sid, tag)] = asyncio.get_running_loop().time()
+                fut = self._slot((sid, tag))
+                if not fut.done(): fut.set_result(body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self.w is w:
+                self.w = None
+                self.up.clear()
+                print(f"[{self.role}] peer link down")
+            w.close()
+
+    def _expire(self):
+        now = asyncio.get_running_loop().time()
+        while self.unclaimed:
+            key, t = next(iter(self.unclaimed.items()))
+            if now - t < self.ttl: break
+            del self.unclaimed[key]
+            self.slots.pop(key, None)
+
+    def _slot(self, key):
+        fut = self.slots.get(key)
+        if fut is None:
+            fut = self.slots[key] = asyncio.get_running_loop().create_future()
+        return fut
+
+    async def send(self, sid, tag, *parts):
+        await self.up.wait()
+        w = self.w
+        # no await between the writes: frames from concurrent senders never interleave
+        w.write(FRAME_HDR.pack(sid, tag, sum(len(p) for p in parts)))
+        for p in parts: w.write(p)
+        await w.drain()
+
+    async def recv(self, sid, tag):
+        try:
+            return await self._slot((sid, tag))
+        finally:
+            self.slots.pop((sid, tag), None)
+            self.unclaimed.pop((sid, tag), None)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import weakref
+
+# The offline half of a read's cross term.
+#
+# In the matrix Du-Atallah exchange (dta_cross_batch in bank_servers.py) the
+# party holding the data opens V = R - B, where R is the share (the first dim
+# rows, or the first dim elements of the flattened share) and B comes from the
+# triple. Once a triple is prefetched (see triple_pool.py) B is known before
+# the read arrives, so V is computed when the triple lands and every write is
+# added to it as it is applied to the share: the read then sends V as it is
+# and only does the final products online.
+#
+# A mask always matches the current share; a read agreeing on an older version
+# computes V from that version instead. Masks live as long as the pool entry
+# holding them.
+class Mask:
+    __slots__ = ("V", "__weakref__")
+
+class Premasks:
+    def __init__(self):
+        self.live = weakref.WeakSet()
+
+    # R (dim x width) is a prefix of the current share, B_i this party's B
+    def make(self, R, B_i):
+        m = Mask()
+        m.V = R - B_i
+        self.live.add(m)
+        return m
+
+    # call right after applying a write, with its flat delta
+    def applied(self, delta):
+        d = delta.reshape(-1)
+        for m in list(self.live):
+            v = m.V.reshape(-1)
+            n = min(len(v), len(d))
+            v[:n] += d[:n]
+
+    # V for a read, or None if the read is not of the current share
+    def take(self, m, current):
+        self.live.discard(m)
+        return m.V if current else None
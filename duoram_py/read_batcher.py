@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import asyncio, random, struct
+import numpy as np
+
+# Server-side micro-batching of reads with a rid.
+#
+# Party A leads: it holds each read for up to `window` seconds (or until `max`
+# reads with the same shape are waiting), then announces the batch to B over
+# the peer link as [batch rid][kind][dim][count][rid]*count. Both parties then
+# stack the reads' query rows in that order and run them as one matrix product:
+# one triple from the share server and one residual exchange, both keyed by the
+# batch rid, for the whole batch. B batches nothing itself; it holds each read
+# until an announcement names it. Both parties must run with batching on.
+# A read given up (timeout, abort) before its batch is formed is withdrawn; once
+# in a batch it is computed anyway and the result dropped, so both parties keep
+# stacking the same rows. timeout bounds how long a batch may take.
+TAG_BATCH = 0x13
+BATCH_HDR = struct.Struct("!qBII")
+
+FLAT, ROWS = 0, 1  # the read selects elements of the flattened share / whole rows
+
+class ReadBatcher:
+    # run(E, kind, batch_rid) computes this party's shares of E times the share
+    def __init__(self, role, link, window, max_reads, run, timeout=None):
+        self.role, self.link, self.window, self.max_reads, self.run = role, link, window, max_reads, run
+        self.timeout = timeout
+        self.pending = {}   # rid -> (kind, E, future for this read's shares)
+        self.arrivals = {}  # rid -> future set once the read is pending here (B)
+        self.claimed = set()  # rids named by an announcement, not yet in its batch (B)
+        self.groups = {}    # (kind, dim) -> [rids] waiting for a batch (A)
+        self.timers = {}
+        self.tasks = set()
+        if role == "B": link.handlers[TAG_BATCH] = self._announced
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _arrival(self, rid):
+        fut = self.arrivals.get(rid)
+        if fut is None:
+            fut = self.arrivals[rid] = asyncio.get_running_loop().create_future()
+        return fut
+
+    # this party's shares of the rows of E times the share (E is k x dim)
+    async def read(self, rid, kind, E):
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[rid] = (kind, E, fut)
+        if self.role == "A":
+            key = (kind, E.shape[1])
+            rids = self.groups.setdefault(key, [])
+            rids.append(rid)
+            if len(rids) >= self.max_reads:
+                self._flush(key)
+            elif len(rids) == 1:
+                self.timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        else:
+            fut_arrived = self._arrival(rid)
+            if not fut_arrived.done(): fut_arrived.set_result(None)
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            self.drop(rid)
+            raise
+
+    # forget a read that is not part of a batch yet
+    def drop(self, rid):
+        if rid in self.claimed: return
+        entry = self.pending.pop(rid, None)
+        self.arrivals.pop(rid, None)
+        if entry is None or self.role == "B": return
+        key = (entry[0], entry[1].shape[1])
+        rids = self.groups.get(key, [])
+        if rid in rids: rids.remove(rid)
+        if not rids: self._flush(key)  # nothing left: drops the group and its timer
+
+    def _flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None: timer.cancel()
+        rids = self.groups.pop(key, [])
+        if not rids: return
+        batch_rid = random.getrandbits(63)
+        body = BATCH_HDR.pack(batch_rid, key[0], key[1], len(rids)) + struct.pack(f"!{len(rids)}q", *rids)
+        self._spawn(self.link.send(batch_rid, TAG_BATCH, body))
+        self._spawn(self._process(batch_rid, key[0], key[1], [self.pending.pop(rid) for rid in rids]))
+
+    def _announced(self, sid, body):
+        batch_rid, kind, dim, n = BATCH_HDR.unpack_from(body)
+        rids = struct.unpack_from(f"!{n}q", body, BATCH_HDR.size)
+        self.claimed.update(rids)
+        self._spawn(self._collect(batch_rid, kind, dim, rids))
+
+    # B: wait for the announced reads to arrive here too
+    async def _collect(self, batch_rid, kind, dim, rids):
+        _, missing = await asyncio.wait([self._arrival(rid) for rid in rids], timeout=self.timeout)
+        for rid in rids:
+            self.arrivals.pop(rid, None)
+            self.claimed.discard(rid)
+        reads = [self.pending.pop(rid) for rid in rids if rid in self.pending]
+        if missing:
+            for _, _, fut in reads:
+                if not fut.done(): fut.set_exception(RuntimeError("batch incomplete"))
+            return
+        await self._process(batch_rid, kind, dim, reads)
+
+    async def _process(self, batch_rid, kind, dim, reads):
+        try:
+            for k, E, _ in reads:
+                if (k, E.shape[1]) != (kind, dim): raise RuntimeError("read does not match its batch")
+            E = np.concatenate([E for _, E, _ in reads])
+            out = await asyncio.wait_for(self.run(E, kind, batch_rid), self.timeout)
+        except Exception as e:
+            for _, _, fut in reads:
+                if not fut.done(): fut.set_exception(e)
+            return
+        off = 0
+        for _, E, fut in reads:
+            if not fut.done(): fut.set_result(out[off:off + len(E)])
+            off += len(E)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import asyncio, mmap, socket, struct
+import multiprocessing as mp
+import numpy as np
+from epochs import EpochGone
+from peer_link import PeerLink
+from share_store import MappedShare
+from wire import pack_u32
+
+# Read workers: N forked processes that serve reads against the share file,
+# one core each, while the owner process keeps everything that changes the
+# share (writes, resize, the log, snapshots) and the reads without a rid.
+#
+# The owner accepts every client connection and peeks at the op and rid
+# without consuming them. A read with a rid goes to worker rid % N: the
+# connected socket itself is passed over a unix socket (SCM_RIGHTS) together
+# with the current row count, and the worker answers the client directly.
+# Both parties route a rid to the same worker index, and worker i of A has its
+# own peer link to worker i of B (peer ports + 1 + i), so the residuals of a
+# read never pass through the owner.
+#
+# The owner keeps writing the share in place, so a worker never reads the map
+# directly: it copies it at an epoch the owner has published (SharedVersion),
+# and the two workers of a read go on until they hold copies of the same epoch
+# (see agree_version in bank_servers.py).
+PEEK_TIMEOUT = 10.0
+HEAD_SIZE = 9  # [op:u8][rid:i64]
+COPY_TRIES = 4  # copies a write landed in before a read gives up (BUSY)
+
+def peek_head(s, routed_ops):
+    s.settimeout(PEEK_TIMEOUT)
+    head = s.recv(1, socket.MSG_PEEK | socket.MSG_WAITALL)
+    if head and head[0] in routed_ops:
+        head = s.recv(HEAD_SIZE, socket.MSG_PEEK | socket.MSG_WAITALL)
+    return head
+
+# The owner's epoch in memory shared with the workers (create it before
+# forking them): a sequence number, 2*epoch, odd while a write is being applied,
+# and whether the shares have diverged (see write_order.py).
+class SharedVersion:
+    def __init__(self):
+        self.mm = mmap.mmap(-1, 16)
+        self.seq = np.frombuffer(self.mm, dtype=np.uint64)
+
+    # owner: around applying a write
+    def begin(self): self.seq[0] |= 1
+    def end(self, epoch): self.seq[0] = 2 * epoch
+    def diverge(self): self.seq[1] = 1
+
+    def check(self):
+        if self.seq[1]: raise RuntimeError("shares diverged; restore both parties from a snapshot")
+
+    # worker: the last epoch published
+    def epoch(self): return int(self.seq[0]) // 2
+
+    # worker: (copy of the share, its epoch), the epoch being `at` or later
+    async def copy(self, share, at=0):
+        for _ in range(COPY_TRIES):
+            while (seq := int(self.seq[0])) % 2 or seq < 2 * at: await asyncio.sleep(0.001)
+            data = np.array(share.data)
+            if int(self.seq[0]) == seq: return data, seq // 2
+            del data  # before the next copy: one copy of the share at a time
+        raise EpochGone(f"writes kept landing in {COPY_TRIES} copies of the share")
+
+class ReadWorkers:
+    def __init__(self, n, role, path, routed_ops, listen_host, peer_listen_port, peer_host, peer_port, make_handler):
+        self.n, self.role, self.path, self.routed_ops = n, role, path, routed_ops
+        self.listen_host, self.peer_listen_port = listen_host, peer_listen_port
+        self.peer_host, self.peer_port = peer_host, peer_port
+        self.make_handler = make_handler  # (share, link) -> handle_user(r, w)
+        self.conns, self.procs = [], []
+        self.tasks = set()  # the loop only keeps weak references to tasks
+
+    # fork the workers; call before the owner starts its event loop
+    def start(self):
+        ctx = mp.get_context("fork")
+        for i in range(self.n):
+            mine, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            p = ctx.Process(target=self._run, args=(i, theirs), daemon=True)
+            p.start()
+            theirs.close()
+            self.conns.append(mine)
+            self.procs.append(p)
+        print(f"[{self.role}] {self.n} read workers started")
+
+    def stop(self):
+        for c in self.conns: c.close()
+        for p in self.procs: p.join(timeout=2)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # ---------- owner side ----------
+    async def accept(self, host, port, backlog, handle_user, rows):
+        loop = asyncio.get_running_loop()
+        lsock = socket.create_server((host, port), backlog=backlog)
+        lsock.setblocking(False)
+        try:
+            while True:
+                s, _ = await loop.sock_accept(lsock)
+                self._spawn(self._dispatch(s, handle_user, rows))
+        finally:
+            lsock.close()
+
+    async def _dispatch(self, s, handle_user, rows):
+        try:
+            head = await asyncio.get_running_loop().run_in_executor(None, peek_head, s, self.routed_ops)
+        except OSError:
+            s.close()
+            return
+        if len(head) == HEAD_SIZE:
+            rid = struct.unpack_from("!q", head, 1)[0]
+            try:
+                socket.send_fds(self.conns[rid % self.n], [pack_u32(rows())], [s.fileno()])
+            except OSError as e:
+                print(f"[{self.role}] read worker {rid % self.n} unreachable: {e}")
+            s.close()
+            return
+        s.setblocking(False)
+        r, w = await asyncio.open_connection(sock=s)
+        await handle_user(r, w)
+
+    # ---------- worker side ----------
+    def _run(self, i, conn):
+        for c in self.conns: c.close()
+        asyncio.run(self._serve(i, conn))
+
+    async def _serve(self, i, conn):
+        loop = asyncio.get_running_loop()
+        link = PeerLink(self.role, self.listen_host, self.peer_listen_port + 1 + i,
+                        self.peer_host, self.peer_port + 1 + i)
+        await link.start()
+        share = MappedShare(self.path, readonly=True)
+        handle_user = self.make_handler(share, link)
+        owner_gone = loop.create_future()
+
+        async def serve_client(fd, rows):
+            if len(share.data) != rows: share.remap(rows)
+            r, w = await asyncio.open_connection(sock=socket.socket(fileno=fd))
+            await handle_user(r, w)
+
+        def on_fd():
+            msg, fds, _, _ = socket.recv_fds(conn, 4, 1)
+            if not msg:
+                loop.remove_reader(conn.fileno())
+                owner_gone.set_result(None)
+                return
+            self._spawn(serve_client(fds[0], struct.unpack("!I", msg)[0]))
+
+        loop.add_reader(conn.fileno(), on_fd)
+        await owner_gone
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Shares live in the ring Z/2^64. Vectors are uint64 arrays, so numpy's
+# wraparound does the reduction for free; on the wire an element is the same
+# 64 bits sent as a signed big-endian i64.
+RING_BITS  = 64
+RING_MASK  = (1 << RING_BITS) - 1
+RING_DTYPE = np.uint64
+
+# ---------- scalars (plain python ints) ----------
+def to_u64(x):   return int(x) & RING_MASK
+def rand_u64(): return int.from_bytes(os.urandom(8), "big")
+def to_i64(x):
+    x = int(x) & RING_MASK
+    return x - (1 << RING_BITS) if x >> (RING_BITS - 1) else x
+def ring_sum(*xs): return to_i64(sum(int(x) for x in xs))
+
+# ---------- vectors ----------
+def to_ring(v):
+    if isinstance(v, np.ndarray):
+        if v.dtype == RING_DTYPE: return v
+        if v.dtype.kind in "iu": return v.astype(np.int64, copy=False).view(RING_DTYPE)
+    return np.array([to_u64(x) for x in v], dtype=RING_DTYPE)
+
+def ring_zeros(n):  return np.zeros(n, dtype=RING_DTYPE)
+def ring_random(n): return np.frombuffer(os.urandom(8*n), dtype=RING_DTYPE).copy()
+
+# ---------- row-partitioned products ----------
+# A product over n >= PAR_MIN_ROWS rows is split into one block of rows per
+# thread; numpy releases the GIL inside the kernels, so the blocks run on
+# separate cores, and adding up the partial products wraps mod 2^64 exactly
+# like the serial product. set_threads(1) (the default) keeps everything serial.
+PAR_MIN_ROWS = 1 << 14
+_threads, _pool, _pool_pid = 1, None, None
+
+def set_threads(n):
+    global _threads
+    _threads = max(1, n)
+
+def _par_map(fn, n):
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():  # a forked child has no pool threads
+        _pool, _pool_pid = ThreadPoolExecutor(_threads), os.getpid()
+    step = -(-n // _threads)
+    return list(_pool.map(fn, [slice(i, i + step) for i in range(0, n, step)]))
+
+def ring_dot(a, b):
+    if _threads == 1 or len(a) < PAR_MIN_ROWS: return int(np.dot(a, b))
+    return to_u64(sum(_par_map(lambda s: int(np.dot(a[s], b[s])), len(a))))
+
+# a (k x n) times b (n x w), split along n
+def ring_matmul(a, b):
+    n = b.shape[0]
+    if _threads == 1 or n < PAR_MIN_ROWS: return np.matmul(a, b)
+    parts = _par_map(lambda s: np.matmul(a[..., s], b[s]), n)
+    out = parts[0]
+    for p in parts[1:]: out += p
+    return out
+
+# ---------- storage engine ----------
+class RingShare:
+    """One party's additive share of the table: rows x width ring elements, 8 bytes each."""
+
+    def __init__(self, rows, width=1):
+        self.buf = ring_zeros(rows*width).reshape(rows, width)
+        self.data = self.buf  # the first rows rows of buf, which has spare capacity after a resize
+        self.lsn = 0  # last logged write applied (see wal.py); a new share is empty
+
+    @property
+    def flat(self):
+        return self.data.reshape(-1)
+
+    def __len__(self):
+        return self.data.size
+
+    # vec may be shorter than the share (a write made before the table grew)
+    def add(self, vec):
+        vec = to_ring(vec).reshape(-1)
+        if len(vec) > self.data.size: raise RuntimeError(f"write of {len(vec)} elements, share holds {self.data.size}")
+        self.flat[:len(vec)] += vec
+
+    # Grow to rows rows (never shrinks). New rows are zero, i.e. a share of an
+    # empty record. Capacity doubles, so growing row by row is amortized O(width).
+    def resize(self, rows):
+        if rows <= len(self.data): return
+        if rows > len(self.buf):
+            buf = ring_zeros(max(rows, 2*len(self.buf))*self.data.shape[1]).reshape(-1, self.data.shape[1])
+            buf[:len(self.data)] = self.data
+            self.buf = buf
+        self.data = self.buf[:rows]
+
+    def restore(self, data, lsn):
+        if data.shape[1] != self.data.shape[1]: raise RuntimeError(f"snapshot is {data.shape}, share is {self.data.shape}")
+        self.resize(len(data))
+        self.data[:len(data)] = data
+        self.data[len(data):] = 0
+        self.lsn = lsn
+
+    def flush(self):
+        pass
+
+    def mark_dirty(self):
+        pass
+
+    def mark_clean(self):
+        pass
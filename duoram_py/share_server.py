@@ -1,77 +1,117 @@
 #!/usr/bin/env python3
-import argparse, socket, struct, threading, random, collections
-
-OP_REQUEST  = 0x31  # client -> server:  [op][dim:u32]
-OP_RESPONSE = 0x33  # server -> client:  [op][dim:u32][sid:i64][a_i:dim*i64][b_i:dim*i64][c_i:i64]
-
-def pack_u8(x):  return struct.pack("!B", x)
-def pack_u32(x): return struct.pack("!I", x & 0xFFFFFFFF)
-def pack_i64(x): return struct.pack("!q", int(x))
-def recv_exact(sock, n):
-    b = b""
-    while len(b) < n:
-        chunk = sock.recv(n - len(b))
-        if not chunk: raise ConnectionError("eof")
-        b += chunk
-    return b
-def read_u8(s):  return struct.unpack("!B", recv_exact(s,1))[0]
-def read_u32(s): return struct.unpack("!I", recv_exact(s,4))[0]
-def read_i64(s): return struct.unpack("!q", recv_exact(s,8))[0]
-
-def rand_elem(): return random.randint(1, 1024)
-def rand_vec(n): return [rand_elem() for _ in range(n)]
-def dot(a,b):    return sum(x*y for x,y in zip(a,b))
+import argparse, socket, threading, random, collections, time
+from ring import ring_random, ring_dot, ring_matmul, rand_u64
+from wire import pack_u8, pack_u32, pack_i64, read_u8, read_u32, read_i64, send_vec
 
+OP_REQUEST     = 0x31  # client -> server:  [op][dim:u32]
+OP_REQUEST_RID = 0x32  # client -> server:  [op][dim:u32][rid:i64]  (pairs only with the same rid)
+OP_RESPONSE    = 0x33  # server -> client:  [op][dim:u32][sid:i64][a_i:dim*i64][b_i:dim*i64][c_i:i64]
+OP_REQUEST_BATCH  = 0x34  # client -> server:  [op][k:u32][dim:u32][width:u32][rid:i64]
+OP_RESPONSE_BATCH = 0x35  # server -> client:  [op][k:u32][dim:u32][width:u32][sid:i64], then for each of
+                          #   the two cross terms: [A_i:k*dim*i64][B_i:dim*width*i64][C_i:k*width*i64]
+
+# key -> requests waiting for their pair, as (conn, arrival time)
 waiting = collections.defaultdict(collections.deque)
 waiting_mu = threading.Lock()
+REAP_EVERY = 1.0  # seconds between sweeps of the waiting requests
+
+# A request whose party gave up (a read turned away or timed out) closes its
+# socket and never gets a pair: drop it, and any request older than ttl.
+def gone(conn):
+    try: return conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError: return False
+    except OSError: return True
+
+def reap(ttl):
+    while True:
+        time.sleep(REAP_EVERY)
+        now, dropped = time.monotonic(), []
+        with waiting_mu:
+            for key in list(waiting):
+                dq = waiting[key]
+                for item in list(dq):
+                    if now - item[1] > ttl or gone(item[0]):
+                        dq.remove(item)
+                        dropped.append(item[0])
+                if not dq: del waiting[key]
+        for conn in dropped: conn.close()
 
 def send_share(s, dim, sid, a_i, b_i, c_i):
-    s.sendall(pack_u8(OP_RESPONSE))
-    s.sendall(pack_u32(dim))
-    s.sendall(pack_i64(sid))
-    for x in a_i: s.sendall(pack_i64(x))
-    for x in b_i: s.sendall(pack_i64(x))
+    s.sendall(pack_u8(OP_RESPONSE) + pack_u32(dim) + pack_i64(sid))
+    send_vec(s, a_i)
+    send_vec(s, b_i)
     s.sendall(pack_i64(c_i))
 
+# Matrix triple for k queries against a dim x width table: A is k x dim, B is
+# dim x width and C = A·B, all additively shared. Each cross term gets its own.
+def make_batch_triples(k, dim, width):
+    shares0, shares1 = [], []
+    for _ in range(2):
+        A0, A1 = ring_random(k*dim).reshape(k, dim), ring_random(k*dim).reshape(k, dim)
+        B0, B1 = ring_random(dim*width).reshape(dim, width), ring_random(dim*width).reshape(dim, width)
+        C  = ring_matmul(A0 + A1, B0 + B1)
+        C0 = ring_random(k*width).reshape(k, width)
+        shares0.append((A0, B0, C0))
+        shares1.append((A1, B1, C - C0))
+    return shares0, shares1
+
+def send_batch_share(s, shape, sid, triples):
+    k, dim, width = shape
+    s.sendall(pack_u8(OP_RESPONSE_BATCH) + pack_u32(k) + pack_u32(dim) + pack_u32(width) + pack_i64(sid))
+    for A_i, B_i, C_i in triples:
+        send_vec(s, A_i.ravel())
+        send_vec(s, B_i.ravel())
+        send_vec(s, C_i.ravel())
+
+def hand_out(conn, send):
+    try:
+        send(conn)
+    finally:
+        try: conn.shutdown(socket.SHUT_RDWR)
+        except: pass
+        conn.close()
+
 def handle_one(conn):
     try:
         op  = read_u8(conn)
-        if op != OP_REQUEST: conn.close(); return
-        dim = read_u32(conn)
+        if op not in (OP_REQUEST, OP_REQUEST_RID, OP_REQUEST_BATCH): conn.close(); return
+        if op == OP_REQUEST_BATCH:
+            shape = (read_u32(conn), read_u32(conn), read_u32(conn))
+            dim = shape[1] if all(shape) else 0
+        else:
+            dim = read_u32(conn)
+            shape = (dim,)
         if dim == 0: conn.close(); return
+        key = (op, shape, read_i64(conn) if op != OP_REQUEST else None)
 
+        dropped, peer = [], None
         with waiting_mu:
-            dq = waiting[dim]
-            if dq:
-                peer = dq.popleft()
-                if not dq: waiting.pop(dim, None)
-            else:
-                dq.append(conn)
-                return
-
-        # generate correlated randomness
-        a0, a1 = rand_vec(dim), rand_vec(dim)
-        b0, b1 = rand_vec(dim), rand_vec(dim)
-        a = [x+y for x,y in zip(a0,a1)]
-        b = [x+y for x,y in zip(b0,b1)]
-        c  = dot(a,b)
-        c0 = rand_elem()
-        c1 = c - c0
+            dq = waiting[key]
+            while dq and peer is None:
+                peer = dq.popleft()[0]
+                if gone(peer): dropped.append(peer); peer = None
+            if not dq: waiting.pop(key, None)
+            if peer is None: waiting[key].append((conn, time.monotonic()))
+        for c in dropped: c.close()
+        if peer is None: return
+
         sid = random.getrandbits(63)  # signed i64 domain; keep positive
 
-        try:
-            send_share(peer, dim, sid, a0, b0, c0)
-        finally:
-            try: peer.shutdown(socket.SHUT_RDWR)
-            except: pass
-            peer.close()
+        if op == OP_REQUEST_BATCH:
+            t0, t1 = make_batch_triples(*shape)
+            hand_out(peer, lambda s: send_batch_share(s, shape, sid, t0))
+            hand_out(conn, lambda s: send_batch_share(s, shape, sid, t1))
+            return
+
+        # generate correlated randomness (uniform over Z/2^64)
+        a0, a1 = ring_random(dim), ring_random(dim)
+        b0, b1 = ring_random(dim), ring_random(dim)
+        c  = ring_dot(a0 + a1, b0 + b1)
+        c0 = rand_u64()
+        c1 = c - c0
 
-        try:
-            send_share(conn, dim, sid, a1, b1, c1)
-        finally:
-            try: conn.shutdown(socket.SHUT_RDWR)
-            except: pass
-            conn.close()
+        hand_out(peer, lambda s: send_share(s, dim, sid, a0, b0, c0))
+        hand_out(conn, lambda s: send_share(s, dim, sid, a1, b1, c1))
 
     except Exception:
         try: conn.close()
@@ -80,6 +120,7 @@ def handle_one(conn):
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--listen", default="0.0.0.0:9300")
+    ap.add_argument("--ttl", type=float, default=60.0)
     args = ap.parse_args()
     host, port = args.listen.split(":")[0], int(args.listen.split(":")[1])
 
@@ -87,6 +128,7 @@ def main():
     ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     ls.bind((host, port))
     ls.listen()
+    threading.Thread(target=reap, args=(args.ttl,), daemon=True).start()
 
     while True:
         c, _ = ls.accept()
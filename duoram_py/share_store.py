@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os, struct
+import numpy as np
+from ring import RING_BITS, RingShare
+
+# On-disk share file: a 64-byte header followed by rows*width little-endian u64
+# ring elements, row-major. The file is mapped, not read, so opening it is O(1)
+# whatever the table size, writes land in the page cache in place, and other
+# processes can map the same file read-only to look at the share.
+STORE_MAGIC   = b"DUORAMSH"
+STORE_VERSION = 1
+# magic, version, ring bits, rows, width, lsn, clean. lsn is the last logged
+# write (see wal.py) the data reflects; it is only trustworthy while clean is
+# set, i.e. the server flushed the map and closed the file normally.
+STORE_HDR     = struct.Struct("<8sIIQIQB")
+STORE_DATA_OFF = 64
+
+def read_header(path):
+    with open(path, "rb") as f:
+        magic, version, bits, rows, width, lsn, clean = STORE_HDR.unpack(f.read(STORE_HDR.size))
+    if magic != STORE_MAGIC or version != STORE_VERSION:
+        raise RuntimeError(f"{path}: not a share store file")
+    if bits != RING_BITS:
+        raise RuntimeError(f"{path}: ring is Z/2^{bits}, expected Z/2^{RING_BITS}")
+    return rows, width, lsn, bool(clean)
+
+def write_header(path, rows, width, lsn, clean):
+    with open(path, "r+b") as f:
+        f.write(STORE_HDR.pack(STORE_MAGIC, STORE_VERSION, RING_BITS, rows, width, lsn, int(clean)))
+        f.flush()
+        os.fsync(f.fileno())
+
+def create(path, rows, width):
+    with open(path, "wb") as f:
+        f.truncate(STORE_DATA_OFF + 8*rows*width)  # sparse: an all-zero share
+    write_header(path, rows, width, 0, True)
+
+class MappedShare(RingShare):
+    """A RingShare whose rows x width matrix is a memory map of a share file."""
+
+    def __init__(self, path, readonly=False):
+        rows, width, lsn, clean = read_header(path)
+        self.path = path
+        self.lsn = lsn if clean else None  # None: contents unknown after a crash
+        self.data = np.memmap(path, dtype="<u8", mode="r" if readonly else "r+",
+                              offset=STORE_DATA_OFF, shape=(rows, width))
+
+    def flush(self):
+        self.data.flush()
+
+    # Extend the file (sparse, so the new rows are zero and cost no I/O) and remap.
+    def resize(self, rows):
+        if rows <= len(self.data): return
+        width = self.data.shape[1]
+        self.data.flush()
+        os.truncate(self.path, STORE_DATA_OFF + 8*rows*width)
+        write_header(self.path, rows, width, self.lsn or 0, False)
+        self.remap(rows)
+
+    # Map the first rows rows of the file (a reader following a resize).
+    def remap(self, rows):
+        self.data = np.memmap(self.path, dtype="<u8", mode=self.data.mode,
+                              offset=STORE_DATA_OFF, shape=(rows, self.data.shape[1]))
+
+    # In-place updates make the file fuzzy until the next clean close.
+    def mark_dirty(self):
+        write_header(self.path, *self.data.shape, self.lsn or 0, False)
+
+    def mark_clean(self):
+        self.flush()
+        write_header(self.path, *self.data.shape, self.lsn, True)
+
+# Open the share file at path, creating a zero share of rows x width if it does
+# not exist yet. An existing file must have the width the server was started
+# with; it keeps its rows if the table was grown online, and is grown to rows
+# otherwise.
+def open_store(path, rows, width, readonly=False):
+    if not os.path.exists(path):
+        if readonly: raise FileNotFoundError(path)
+        create(path, rows, width)
+    share = MappedShare(path, readonly)
+    if share.data.shape[1] != width:
+        raise RuntimeError(f"{path}: holds {share.data.shape[0]} x {share.data.shape[1]}, "
+                           f"server started with --width {width}")
+    if not readonly: share.resize(rows)
+    return share
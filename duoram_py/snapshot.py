@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import io, os, threading
+import numpy as np
+
+# Background snapshots of a party's share.
+#
+# A snapshot is a plain .npy file (rows x width, little-endian u64) plus a
+# "<file>.lsn" sidecar holding the lsn of the last logged write it contains,
+# so a restored snapshot can be brought up to date from the write-ahead log.
+#
+# A RAM share is copy-on-write across fork(), so the server forks: the child
+# writes the share it inherited and exits, while the parent keeps serving. A
+# memory-mapped store is shared with a child instead, so it is written by a
+# thread straight from the live map, CHUNK_ROWS rows at a time; writes go
+# through add() meanwhile and land between two chunks. The rows copied after
+# a write hold it, so once all rows are copied the thread subtracts each such
+# write from those rows of the file: the snapshot is the share as it was when
+# it started, and no more than one chunk is ever held in memory.
+# The file is written as "<file>.part" and renamed when complete; progress is
+# the size of the .part file.
+CHUNK_ROWS = 1 << 16
+
+IDLE, RUNNING, DONE, FAILED = range(4)
+
+def npy_header(shape):
+    buf = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buf, {"descr": "<u8", "fortran_order": False, "shape": shape})
+    return buf.getvalue()
+
+# chunks: the rows, in order; fix(part file), if given, runs before the fsync
+def write_npy(shape, chunks, path, lsn, fix=None):
+    part = path + ".part"
+    with open(part, "wb") as f:
+        f.write(npy_header(shape))
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype="<u8").tobytes())
+        f.flush()
+        if fix is not None: fix(part)
+        os.fsync(f.fileno())
+    with open(path + ".lsn", "w") as f:
+        f.write(f"{lsn}\n")
+    os.replace(part, path)
+
+# the rows are mapped, not read: restoring copies them in from the file
+def load_npy(path):
+    data = np.load(path, mmap_mode="r").astype(np.uint64, copy=False)
+    with open(path + ".lsn") as f:
+        lsn = int(f.read())
+    return data, lsn
+
+class Snapshotter:
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = None
+        self.path = None
+        self.total = 0
+        self.state = IDLE
+        self.thread = None
+        self.lock = threading.Lock()
+        self.pos = 0          # rows copied so far by the thread
+        self.written = None   # (pos, delta fn) of each write while the thread copies
+
+    # apply a write to the share (instead of share.add); undo() returns its flat delta
+    def add(self, share, delta, undo):
+        with self.lock:
+            share.add(delta)
+            if self.written is not None: self.written.append((self.pos, undo))
+
+    def start(self, share, name):
+        self.poll()
+        if self.state == RUNNING: raise RuntimeError("a snapshot is already running")
+        if os.path.basename(name) != name or not name: raise RuntimeError("bad snapshot name")
+        path = os.path.join(self.directory, name)
+        data, lsn = share.data, share.lsn
+        self.path, self.state = path, RUNNING
+        self.total = len(npy_header(data.shape)) + data.nbytes
+
+        if isinstance(data, np.memmap):
+            self.pid, self.pos, self.written = None, 0, []
+            self.thread = threading.Thread(target=self._copy, args=(share, data.shape, path, lsn), daemon=True)
+            self.thread.start()
+            return
+
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                write_npy(data.shape, (data[i:i+CHUNK_ROWS] for i in range(0, len(data), CHUNK_ROWS)), path, lsn)
+                code = 0
+            finally:
+                os._exit(code)
+        self.pid = pid
+
+    def _copy(self, share, shape, path, lsn):
+        written = []
+        def chunks():
+            for i in range(0, shape[0], CHUNK_ROWS):
+                with self.lock:
+                    chunk = np.array(share.data[i:min(i + CHUNK_ROWS, shape[0])])
+                    self.pos = i + len(chunk)
+                yield chunk
+            with self.lock:
+                written.extend(self.written)
+                self.written = None
+
+        def fix(part):
+            rows = np.memmap(part, dtype="<u8", mode="r+", offset=len(npy_header(shape)), shape=shape)
+            flat = rows.reshape(-1)
+            for pos, undo in written:
+                d = undo().reshape(-1)
+                n = min(len(d), flat.size)
+                if pos * shape[1] < n: flat[pos*shape[1]:n] -= d[pos*shape[1]:n]
+            rows.flush()
+
+        try:
+            write_npy(shape, chunks(), path, lsn, fix)
+            self.state = DONE
+        except Exception as e:
+            print(f"snapshot {path} failed: {e!r}")
+            self.state = FAILED
+        finally:
+            self.written = None
+
+    # (state, bytes written, total bytes)
+    def poll(self):
+        if self.state == RUNNING and self.pid is not None:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                self.state = DONE if os.waitstatus_to_exitcode(status) == 0 else FAILED
+        if self.state == RUNNING:
+            try: done = os.path.getsize(self.path + ".part")
+            except OSError: done = 0
+        else:
+            done = self.total if self.state == DONE else 0
+        return self.state, done, self.total
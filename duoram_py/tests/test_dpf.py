@@ -0,0 +1,51 @@
+import random
+import numpy as np
+import pytest
+import dpf
+from ring import to_ring, RING_DTYPE
+
+def point(size, alpha, beta):
+    out = np.zeros((size, len(beta)), dtype=RING_DTYPE)
+    out[alpha] = to_ring(beta)
+    return out
+
+def both(k0, k1, size): return dpf.eval_full(k0, size) + dpf.eval_full(k1, size)
+
+@pytest.mark.parametrize("n_bits", [1, 2, 3, 5, 8, 11])
+def test_full_domain_is_the_point_function(n_bits):
+    size = 1 << n_bits
+    for alpha in {0, size - 1, random.randrange(size)}:
+        k0, k1 = dpf.gen(alpha, [7], n_bits)
+        assert np.array_equal(both(k0, k1, size), point(size, alpha, [7]))
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 100, 1000, 1025])
+def test_truncated_domain(size):
+    n_bits = dpf.domain_bits(size)
+    for alpha in {0, size - 1, random.randrange(size)}:
+        k0, k1 = dpf.gen(alpha, [1], n_bits)
+        assert np.array_equal(both(k0, k1, size), point(size, alpha, [1]))
+
+# keys made for a larger table evaluate to its prefix (see key_rows in bank_servers.py)
+def test_prefix_of_a_larger_domain():
+    k0, k1 = dpf.gen(3, [9], 8)
+    assert np.array_equal(both(k0, k1, 10), point(10, 3, [9]))
+    k0, k1 = dpf.gen(200, [9], 8)
+    assert not both(k0, k1, 10).any()
+
+@pytest.mark.parametrize("beta", [[0], [1, 2, 3], [-1, 2**63 - 1, -2**63], list(range(10)), list(range(1, 18))])
+def test_vector_beta(beta):
+    size = 37
+    alpha = random.randrange(size)
+    k0, k1 = dpf.gen(alpha, beta, dpf.domain_bits(size))
+    assert len(k0) == len(k1) == dpf.key_size(dpf.domain_bits(size), len(beta))
+    assert np.array_equal(both(k0, k1, size), point(size, alpha, beta))
+
+def test_one_key_alone_is_not_the_point_function():
+    k0, _ = dpf.gen(5, [1], 4)
+    assert not np.array_equal(dpf.eval_full(k0, 16), point(16, 5, [1]))
+
+def test_bad_arguments():
+    with pytest.raises(ValueError): dpf.gen(16, [1], 4)
+    k0, _ = dpf.gen(1, [1], 4)
+    with pytest.raises(ValueError): dpf.eval_full(k0, 17)
+    with pytest.raises(ValueError): dpf.eval_full(k0[:-1], 16)
@@ -0,0 +1,85 @@
+import asyncio, os, struct
+import numpy as np
+import dpf
+from ring import RingShare, to_ring
+from wire import pack_u32, encode_vec
+from wal import WriteAheadLog, KIND_VEC, KIND_DPF, KIND_RESIZE, KIND_FIELD, WAL_HDR
+from bank_servers import replay_wal, expand_write_key, expand_field_key
+
+def payloads(wal): return [(lsn, kind, bytes(p)) for lsn, kind, p in wal.records(0)]
+
+def test_append_and_reopen(tmp_path):
+    path = str(tmp_path / "wal")
+    wal = WriteAheadLog(path, 0.001)
+    assert [wal.append(KIND_VEC, b"x" * i) for i in range(1, 4)] == [1, 2, 3]
+    asyncio.run(wal.durable(3))
+    assert wal.synced == 3
+    wal.close()
+
+    wal = WriteAheadLog(path, 0.001)
+    assert (wal.base_lsn, wal.lsn) == (0, 3)
+    assert payloads(wal) == [(1, KIND_VEC, b"x"), (2, KIND_VEC, b"xx"), (3, KIND_VEC, b"xxx")]
+    assert [lsn for lsn, _, _ in wal.records(1)] == [2, 3]
+    wal.close()
+
+def torn(tmp_path, damage):
+    path = str(tmp_path / "wal")
+    wal = WriteAheadLog(path, 0.001)
+    for i in range(3): wal.append(KIND_DPF, bytes([i]) * 10)
+    wal.close()
+    end_of_2 = os.path.getsize(path) - (os.path.getsize(path) - WAL_HDR.size) // 3
+    damage(path)
+
+    wal = WriteAheadLog(path, 0.001)
+    assert wal.lsn == 2
+    assert os.path.getsize(path) == end_of_2
+    assert wal.append(KIND_DPF, b"new") == 3
+    wal.close()
+    assert payloads(WriteAheadLog(path, 0.001)) == [(1, KIND_DPF, b"\0" * 10), (2, KIND_DPF, b"\1" * 10),
+                                                    (3, KIND_DPF, b"new")]
+
+def test_torn_tail_is_truncated(tmp_path):
+    torn(tmp_path, lambda path: os.truncate(path, os.path.getsize(path) - 3))
+
+def test_bad_crc_at_tail_is_truncated(tmp_path):
+    def flip(path):
+        with open(path, "r+b") as f:
+            f.seek(-6, os.SEEK_END)
+            b = f.read(1)
+            f.seek(-6, os.SEEK_END)
+            f.write(bytes([b[0] ^ 0xFF]))
+    torn(tmp_path, flip)
+
+def test_replay_reproduces_the_share(tmp_path):
+    rows, width = 8, 3
+    share = RingShare(rows, width)
+    wal = WriteAheadLog(str(tmp_path / "wal"), 0.001)
+    def logged(kind, payload, delta=None):
+        if delta is not None: share.add(delta)
+        share.lsn = wal.append(kind, payload)
+
+    vec = to_ring(range(1, 7))
+    logged(KIND_VEC, encode_vec(vec), vec)
+    k0, _ = dpf.gen(5, [4, -5, 6], dpf.domain_bits(rows))
+    logged(KIND_DPF, pack_u32(rows) + k0, expand_write_key(k0, rows, width))
+    logged(KIND_RESIZE, struct.pack("!I", 12))
+    share.resize(12)
+    f0, _ = dpf.gen(9, [100], dpf.domain_bits(12))
+    logged(KIND_FIELD, pack_u32(12) + pack_u32(1) + f0, expand_field_key(f0, 12, width, 1))
+    # a key for the 8 rows the client knew expands over those 8 only
+    t0, _ = dpf.gen(2, [7], dpf.domain_bits(rows))
+    logged(KIND_FIELD, pack_u32(rows) + pack_u32(0) + t0, expand_field_key(t0, rows, width, 0))
+    wal.close()
+
+    wal = WriteAheadLog(str(tmp_path / "wal"), 0.001)
+    fresh = RingShare(rows, width)
+    assert replay_wal(fresh, wal) == 5
+    assert fresh.lsn == 5
+    assert np.array_equal(fresh.data, share.data)
+
+    # from a share already at lsn 2 only the later records are replayed
+    mid = RingShare(rows, width)
+    mid.add(vec); mid.add(expand_write_key(k0, rows, width)); mid.lsn = 2
+    assert replay_wal(mid, wal) == 3
+    assert np.array_equal(mid.data, share.data)
+    wal.close()
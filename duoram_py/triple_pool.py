@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import asyncio, collections, random, struct
+
+# Triples fetched ahead of the reads that use them.
+#
+# Party A leads: for every triple shape its reads ask for it keeps up to
+# `depth` triples buffered. Each fill draws a fresh fill rid and announces
+# [k][dim][width] to B under it, then both parties fetch the triple from the
+# share server with that rid, so both end up holding it under the same sid.
+# A read on A takes the oldest buffered triple of its shape and tells B its
+# sid (see agree_epoch in bank_servers.py); B draws the triple with that sid,
+# waiting for its own fetch if it is still on the way. An empty buffer is a
+# miss: the read fetches its triple by its own rid, as without the pool.
+#
+# Triples buffered while the link was down, or on the far side of a peer
+# restart, never pair up: A drops those it fetched over an earlier connection,
+# B keeps only the most recent ones.
+#
+# prepare(shape, triples), if given, runs as soon as a triple lands and its
+# result is handed out with the triple (see premask.py).
+TAG_PREFETCH = 0x15
+SHAPE = struct.Struct("!III")
+
+class TriplePool:
+    # fetch(shape, rid) -> (sid, triples) asks the share server for one triple
+    def __init__(self, role, link, fetch, depth, timeout=None, max_shapes=8, prepare=None):
+        self.role, self.link, self.fetch, self.depth = role, link, fetch, depth
+        self.prepare = prepare or (lambda shape, triples: None)
+        self.timeout, self.max_shapes = timeout, max_shapes
+        self.ready = collections.OrderedDict()  # shape -> deque of (link, sid, triples, prepared) (A)
+        self.filling = collections.Counter()    # shape -> fills on the way (A)
+        self.drawn = collections.OrderedDict()  # sid -> (triples, prepared), waiting to be drawn (B)
+        self.waiters = {}                       # sid -> future of a read drawing it early (B)
+        self.tasks = set()
+        if role == "B": link.handlers[TAG_PREFETCH] = self._announced
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # A: (sid, triples, prepared) of the oldest buffered triple of this shape, or None
+    def take(self, shape):
+        q = self.ready.setdefault(shape, collections.deque())
+        self.ready.move_to_end(shape)
+        while len(self.ready) > self.max_shapes: self.ready.popitem(last=False)
+        while q and q[0][0] is not self.link.w: q.popleft()
+        got = q.popleft()[1:] if q else None
+        for _ in range(self.depth - len(q) - self.filling[shape]): self._spawn(self._fill(shape))
+        return got
+
+    async def _fill(self, shape):
+        self.filling[shape] += 1
+        try:
+            rid = -1 - random.getrandbits(62)  # client rids are >= 0
+            await self.link.send(rid, TAG_PREFETCH, SHAPE.pack(*shape))
+            conn = self.link.w
+            sid, triples = await asyncio.wait_for(self.fetch(shape, rid), self.timeout)
+            if shape in self.ready: self.ready[shape].append((conn, sid, triples, self.prepare(shape, triples)))
+        except Exception as e:
+            print(f"[A] prefetch {shape} failed: {e!r}")
+        finally:
+            self.filling[shape] -= 1
+            if not self.filling[shape]: del self.filling[shape]
+
+    def _announced(self, rid, body):
+        self._spawn(self._fetched(SHAPE.unpack(body), rid))
+
+    async def _fetched(self, shape, rid):
+        try:
+            sid, triples = await asyncio.wait_for(self.fetch(shape, rid), self.timeout)
+        except Exception as e:
+            print(f"[B] prefetch {shape} failed: {e!r}")
+            return
+        got = (triples, self.prepare(shape, triples))
+        fut = self.waiters.pop(sid, None)
+        if fut is not None:
+            if not fut.done(): fut.set_result(got)
+            return
+        self.drawn[sid] = got
+        while len(self.drawn) > self.depth * self.max_shapes: self.drawn.popitem(last=False)
+
+    # B: (triples, prepared) of the triple A drew under sid
+    async def draw(self, sid):
+        if sid in self.drawn: return self.drawn.pop(sid)
+        fut = self.waiters[sid] = asyncio.get_running_loop().create_future()
+        try:
+            return await fut
+        finally:
+            self.waiters.pop(sid, None)
@@ -1,21 +1,29 @@
 #!/usr/bin/env python3
-import argparse, socket, struct, random, threading
+import argparse, socket, random, threading, time
+from ring import ring_sum, ring_random, to_ring
+import dpf
+from wire import pack_u8, pack_u32, pack_i64, recv_exact, read_u8, read_u32, read_vec, send_vec
+from admin import info
+from admission import Busy
 
 OP_WRITE_VEC   = 0x40
+OP_WRITE_VEC_WID = 0x4B
+OP_WRITE_DPF   = 0x46
+OP_ADD_DPF     = 0x47
+OP_TRANSFER_DPF = 0x48
+OP_OVERWRITE_DPF = 0x49
+OP_AGGREGATE   = 0x4A
+AGG_SUM, AGG_PUBLIC, AGG_SHARED = 0, 1, 2
 OP_READ_SECURE = 0x41
+OP_READ_BATCH  = 0x43
+OP_READ_ROWS   = 0x44
+OP_READ_DPF    = 0x45
 STR_SIZE = 10
 
-def pack_u8(x):  return struct.pack("!B", x)
-def pack_u32(x): return struct.pack("!I", x & 0xFFFFFFFF)
-def pack_i64(x): return struct.pack("!q", int(x))
-def recv_exact(sock, n):
-    b = b""
-    while len(b) < n:
-        chunk = sock.recv(n - len(b))
-        if not chunk: raise ConnectionError("eof")
-        b += chunk
-    return b
-def read_i64(s): return struct.unpack("!q", recv_exact(s,8))[0]
+# read replies start with a status byte; READ_BUSY is followed by [retry_ms:u32],
+# READ_ERROR by [len:u32][message]
+READ_OK, READ_BUSY, READ_ERROR = 0, 1, 2
+READ_TRIES = 50  # busy answers before read_both gives up
 
 def connect(hostport):
     h,p = hostport.split(":")
@@ -23,75 +31,218 @@ def connect(hostport):
     s.connect((h, int(p)))
     return s
 
-def rand_vec(n): return [random.randint(1,1024) for _ in range(n)]
+def new_rid(): return random.getrandbits(63)
 
-def make_standard_basis_share(dim, idx, val):
-    e = [0]*dim; e[idx] = int(val)
-    f = rand_vec(dim)
-    for i in range(dim): e[i] -= f[i]
-    return e, f  # e = (val*e_idx) - f, f  -> e+f = val*e_idx
+# Every write carries a wid, the same on both parties: that is how B puts the
+# writes in the order A applied them (see write_order.py).
+#
+# write_vec, read_shares and read_rows are the client calls for the dense
+# frames (OP_WRITE_VEC_WID, OP_READ_BATCH, OP_READ_ROWS), which take a share of
+# the whole vector or selection matrix instead of DPF keys; main() uses the DPF
+# ops and does not call them.
+def write_vec(hp, vec, wid):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_WRITE_VEC_WID) + pack_i64(wid) + pack_u32(len(vec)))
+    send_vec(s, vec)
+    recv_exact(s, 2)  # "OK"
+    s.close()
+
+# DPF keys go with the rows they are expanded over (the dim they were made
+# for): both parties expand that many, whatever their own table holds.
+def write_dpf(hp, rows, key, wid):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_WRITE_DPF) + pack_i64(wid) + pack_u32(rows) + pack_u32(len(key)) + key)
+    recv_exact(s, 2)  # "OK"
+    s.close()
+
+# Add to one numeric field of a record: field is the element of the record
+# holding a signed i64, the key a DPF for idx -> amount.
+def add_dpf(hp, rows, field, key, wid):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_ADD_DPF) + pack_i64(wid) + pack_u32(rows) + pack_u32(field) + pack_u32(len(key)) + key)
+    recv_exact(s, 2)  # "OK"
+    s.close()
+
+# Credit amount to (debit: subtract it from) the numeric field of record idx
+# in one round: the delta is secret-shared, nothing is read first.
+def credit(c0, c1, dim, idx, field, amount):
+    k0, k1 = dpf.gen(idx, [amount], dpf.domain_bits(dim))
+    wid = new_rid()
+    t0 = threading.Thread(target=add_dpf, args=(c0, dim, field, k0, wid))
+    t1 = threading.Thread(target=add_dpf, args=(c1, dim, field, k1, wid))
+    t0.start(); t1.start(); t0.join(); t1.join()
+
+def debit(c0, c1, dim, idx, field, amount): credit(c0, c1, dim, idx, field, -amount)
+
+def transfer_dpf(hp, rows, field, keys, wid):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_TRANSFER_DPF) + pack_i64(wid) + pack_u32(rows) + pack_u32(field)
+              + b"".join(pack_u32(len(k)) + k for k in keys))
+    recv_exact(s, 2)  # "OK"
+    s.close()
+
+# Move amount from record src to record dst in one round: each server gets a
+# debit key and a credit key and applies both as a single write. There is no
+# overdraft check; the servers never see either balance.
+def transfer(c0, c1, dim, src, dst, field, amount):
+    n_bits = dpf.domain_bits(dim)
+    (d0, d1), (k0, k1) = dpf.gen(src, [-amount], n_bits), dpf.gen(dst, [amount], n_bits)
+    wid = new_rid()
+    t0 = threading.Thread(target=transfer_dpf, args=(c0, dim, field, (d0, k0), wid))
+    t1 = threading.Thread(target=transfer_dpf, args=(c1, dim, field, (d1, k1), wid))
+    t0.start(); t1.start(); t0.join(); t1.join()
 
-def write_vec(hp, vec):
+
+def overwrite_dpf(hp, rows, key, new, rid):
     s = connect(hp)
-    s.sendall(pack_u8(OP_WRITE_VEC))
-    s.sendall(pack_u32(len(vec)))
-    for v in vec: s.sendall(pack_i64(v))
+    s.sendall(pack_u8(OP_OVERWRITE_DPF) + pack_i64(rid) + pack_u32(rows) + pack_u32(len(key)) + key + pack_u32(len(new)))
+    send_vec(s, new)
     recv_exact(s, 2)  # "OK"
     s.close()
 
-def read_share(hp, vec):
+# Set record idx to vals (STR_SIZE elements) in one request per server: each
+# gets its share of the selection (a DPF key) and of the new value, and the
+# servers work out the correction themselves; the old value is never read.
+# The servers log and keep for undo a dense rows x width delta per overwrite
+# (see CONTRIBUTING.md), so --op write still reads and sends a DPF delta.
+def overwrite(c0, c1, dim, idx, vals):
+    k0, k1 = dpf.gen(idx, [1], dpf.domain_bits(dim))
+    n0 = ring_random(len(vals))
+    n1 = to_ring(vals) - n0
+    rid = new_rid()
+    t0 = threading.Thread(target=overwrite_dpf, args=(c0, dim, k0, n0, rid))
+    t1 = threading.Thread(target=overwrite_dpf, args=(c1, dim, k1, n1, rid))
+    t0.start(); t1.start(); t0.join(); t1.join()
+
+# The server turned the read away: raise Busy with its retry-after hint, or
+# RuntimeError with its message if the read failed there.
+def read_status(s):
+    status = read_u8(s)
+    if status == READ_BUSY:
+        retry_ms = read_u32(s)
+        s.close()
+        raise Busy(retry_ms)
+    if status == READ_ERROR:
+        msg = recv_exact(s, read_u32(s)).decode()
+        s.close()
+        raise RuntimeError(f"server: {msg}")
+
+# Both parties must be sent the same rid for the same logical read: that is how
+# they pair it up when many reads are in flight at once.
+def read_shares(hp, mat, rid):
+    k, dim = mat.shape
+    s = connect(hp)
+    s.sendall(pack_u8(OP_READ_BATCH) + pack_i64(rid) + pack_u32(dim) + pack_u32(k))
+    send_vec(s, mat.ravel())
+    read_status(s)
+    shares = read_vec(s, k)
+    s.close()
+    return shares
+
+# The servers store the table as dim rows of STR_SIZE elements; one dim-length
+# selection vector per record returns the whole row.
+def read_rows(hp, mat, rid):
+    k, dim = mat.shape
+    s = connect(hp)
+    s.sendall(pack_u8(OP_READ_ROWS) + pack_i64(rid) + pack_u32(dim) + pack_u32(k))
+    send_vec(s, mat.ravel())
+    read_status(s)
+    width = read_u32(s)
+    if width != STR_SIZE: raise RuntimeError(f"server row width {width} != STR_SIZE {STR_SIZE}")
+    shares = read_vec(s, k*width)
+    s.close()
+    return shares
+
+# Same answer as read_rows(), but each selection vector is sent as a DPF key
+# (O(log dim) bytes) that the server expands itself.
+def read_rows_dpf(hp, rows, keys, rid):
+    s = connect(hp)
+    s.sendall(pack_u8(OP_READ_DPF) + pack_i64(rid) + pack_u32(rows) + pack_u32(len(keys)))
+    for key in keys: s.sendall(pack_u32(len(key)) + key)
+    read_status(s)
+    width = read_u32(s)
+    if width != STR_SIZE: raise RuntimeError(f"server row width {width} != STR_SIZE {STR_SIZE}")
+    shares = read_vec(s, len(keys)*width)
+    s.close()
+    return shares
+
+# call(hp, arg, rid) on both servers at once, with arg0/arg1, and recombine
+# the shares. If either server is busy the read is retried, with a fresh rid,
+# after the hinted delay, up to tries times (then Busy is raised); any other
+# error from either server is raised.
+def read_both(c0, c1, call, arg0, arg1, tries=READ_TRIES):
+    for attempt in range(tries):
+        rid = new_rid()
+        shares, busy, errors = [None, None], [], []
+        def ri(k, hp, arg):
+            try: shares[k] = call(hp, arg, rid)
+            except Busy as e: busy.append(e.retry_ms)
+            except Exception as e: errors.append(e)
+        threads = [threading.Thread(target=ri, args=(0, c0, arg0), daemon=True),
+                   threading.Thread(target=ri, args=(1, c1, arg1), daemon=True)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        if errors: raise errors[0]
+        if not busy: break
+        if attempt == tries - 1: raise Busy(max(busy))
+        time.sleep(max(busy) / 1000)
+    return [ring_sum(x0, x1) for x0, x1 in zip(*shares)]
+
+# All STR_SIZE elements of record idx in one OP_READ_DPF per party.
+def read_block(c0, c1, dim, idx):
+    k0, k1 = dpf.gen(idx, [1], dpf.domain_bits(dim))
+    return read_both(c0, c1, lambda hp, key, rid: read_rows_dpf(hp, dim, [key], rid), k0, k1)
+
+def aggregate_share(hp, mode, weights, rid):
     s = connect(hp)
-    s.sendall(pack_u8(OP_READ_SECURE))
-    s.sendall(pack_u32(len(vec)))
-    for v in vec: s.sendall(pack_i64(v))
-    share = read_i64(s)
+    s.sendall(pack_u8(OP_AGGREGATE) + pack_i64(rid) + pack_u8(mode) + pack_u32(len(weights)))
+    send_vec(s, weights)
+    read_status(s)
+    shares = read_vec(s, read_u32(s))
     s.close()
-    return share
+    return shares
+
+# Column sums over the whole table (weights=None), or weighted by one weight
+# per row for the first len(weights) rows. Public weights go to both servers
+# as they are and, like the plain sum, cost each server one local pass over
+# its share; secret weights are split into shares and cost a row read.
+def aggregate(c0, c1, weights=None, secret=False):
+    if weights is None:
+        w0 = w1 = to_ring([])
+        mode = AGG_SUM
+    elif not secret:
+        w0 = w1 = to_ring(weights)
+        mode = AGG_PUBLIC
+    else:
+        w0 = ring_random(len(weights))
+        w1 = to_ring(weights) - w0
+        mode = AGG_SHARED
+    return read_both(c0, c1, lambda hp, w, rid: aggregate_share(hp, mode, w, rid), w0, w1)
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--op", required=True, choices=["write","read"])
-    ap.add_argument("--dim", type=int, required=True)
-    ap.add_argument("--idx", type=int, required=True)
+    ap.add_argument("--op", required=True, choices=["write","overwrite","read","credit","debit","balance","transfer","total"])
+    ap.add_argument("--dim", type=int, default=None)
+    ap.add_argument("--idx", type=int, default=None)
     ap.add_argument("--val", type=str, default=0)
+    ap.add_argument("--field", type=int, default=0)
+    ap.add_argument("--to", type=int, default=None)
     ap.add_argument("--c0", required=True)
     ap.add_argument("--c1", required=True)
     args = ap.parse_args()
 
-    # len of ram = 10 * dim
+    # len of ram = 10 * dim; by default ask the server (the table can grow online)
+    # a resize reaches the parties one at a time: use the rows both have
+    if args.dim is None: args.dim = min(info(args.c0)[0], info(args.c1)[0])
 
-    if args.idx >= args.dim: raise SystemExit("idx < dim required")
+    if args.op != "total" and not (args.idx is not None and 0 <= args.idx < args.dim):
+        raise SystemExit("idx < dim required")
+    if args.op == "transfer" and not (args.to is not None and 0 <= args.to < args.dim):
+        raise SystemExit("transfer needs --to < dim")
 
-    if args.op == "write":
+    if args.op in ("write", "overwrite"):
         print(f"WRITE idx={args.idx} value={args.val}")
 
-        stored_vals = [[0, 0] for _ in range(STR_SIZE)]
-        threads = []
-        sbv = []
-        lock_c0 = threading.Lock()
-        lock_c1 = threading.Lock()
-
-        for i in range(STR_SIZE):
-            ei0, ei1 = make_standard_basis_share(args.dim*STR_SIZE, STR_SIZE*args.idx + i, 1)
-            sbv.append( (ei0, ei1) )
-            def ri0(i=i):
-                with lock_c0:
-                    stored_vals[i][0] = read_share(args.c0, sbv[i][0])
-
-            def ri1(i=i):
-                with lock_c1:
-                    stored_vals[i][1] = read_share(args.c1, sbv[i][1])
-
-            ti0 = threading.Thread(target=ri0, daemon=True)
-            ti1 = threading.Thread(target=ri1, daemon=True)
-            ti0.start(); ti1.start()
-            threads += [ti0, ti1]
-
-        for t in threads: 
-            t.join()
-        
-        print(f"READ idx={args.idx} -> shares {stored_vals}")
-
         vals_ascii = [0]*STR_SIZE
         for i in range(len(args.val)):
             if i >= STR_SIZE:
@@ -100,45 +251,37 @@ def main():
             vals_ascii[i] = ord(args.val[i])
 
         print(f"vals_ascii = {vals_ascii}")
-        e0, e1 = [0]*args.dim * STR_SIZE, [0]*args.dim * STR_SIZE
-        for i in range(STR_SIZE):
-            ei0, ei1 = make_standard_basis_share(args.dim * STR_SIZE, STR_SIZE*args.idx + i, vals_ascii[i] - stored_vals[i][0] - stored_vals[i][1])
-            e0 = [x+y for x,y in zip(e0, ei0)]
-            e1 = [x+y for x,y in zip(e1, ei1)]
-            
-        t0 = threading.Thread(target=write_vec, args=(args.c0, e0))
-        t1 = threading.Thread(target=write_vec, args=(args.c1, e1))
-        t0.start(); t1.start(); t0.join(); t1.join()
+        if args.op == "overwrite":
+            overwrite(args.c0, args.c1, args.dim, args.idx, vals_ascii)
+        else:
+            stored_vals = read_block(args.c0, args.c1, args.dim, args.idx)
+            print(f"READ idx={args.idx} -> {stored_vals}")
+            delta = [ring_sum(vals_ascii[i], -stored_vals[i]) for i in range(STR_SIZE)]
+            k0, k1 = dpf.gen(args.idx, delta, dpf.domain_bits(args.dim))
+
+            wid = new_rid()
+            t0 = threading.Thread(target=write_dpf, args=(args.c0, args.dim, k0, wid))
+            t1 = threading.Thread(target=write_dpf, args=(args.c1, args.dim, k1, wid))
+            t0.start(); t1.start(); t0.join(); t1.join()
         print(f"WRITE idx={args.idx} value={args.val}")
 
+    elif args.op in ("credit", "debit"):
+        (credit if args.op == "credit" else debit)(args.c0, args.c1, args.dim, args.idx, args.field, int(args.val))
+        print(f"{args.op.upper()} idx={args.idx} field={args.field} amount={args.val}")
+
+    elif args.op == "transfer":
+        transfer(args.c0, args.c1, args.dim, args.idx, args.to, args.field, int(args.val))
+        print(f"TRANSFER idx={args.idx} -> {args.to} field={args.field} amount={args.val}")
+
+    elif args.op == "total":
+        print(f"TOTAL field={args.field} -> {aggregate(args.c0, args.c1)[args.field]}")
+
+    elif args.op == "balance":
+        x = read_block(args.c0, args.c1, args.dim, args.idx)
+        print(f"BALANCE idx={args.idx} field={args.field} -> {x[args.field]}")
+
     else:
-        stored_vals = [[0, 0] for _ in range(STR_SIZE)]
-        threads = []
-        sbv = []
-        lock_c0 = threading.Lock()
-        lock_c1 = threading.Lock()
-
-        for i in range(STR_SIZE):
-            ei0, ei1 = make_standard_basis_share(args.dim*STR_SIZE, STR_SIZE*args.idx + i, 1)
-            sbv.append( (ei0, ei1) )
-            def ri0(i=i):
-                with lock_c0:
-                    stored_vals[i][0] = read_share(args.c0, sbv[i][0])
-
-            def ri1(i=i):
-                with lock_c1:
-                    stored_vals[i][1] = read_share(args.c1, sbv[i][1])
-
-            ti0 = threading.Thread(target=ri0, daemon=True)
-            ti1 = threading.Thread(target=ri1, daemon=True)
-            ti0.start(); ti1.start()
-            threads += [ti0, ti1]
-
-        for t in threads: 
-            t.join()
-        
-        # print(f"READ idx={args.idx} -> shares {stored_vals}")
-        x = [a[0]+a[1] for a in stored_vals]
+        x = read_block(args.c0, args.c1, args.dim, args.idx)
         s = "".join(map(chr, x))  
         print(f"READ idx={args.idx} -> {s}")
 
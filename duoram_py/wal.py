@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import asyncio, os, struct, zlib
+
+# Write-ahead log of the writes a party has applied to its share.
+#
+# File: [magic:8][base_lsn:u64] then records [len:u32][lsn:u64][kind:u8][payload:len][crc32:u32].
+# Records have consecutive lsns starting at base_lsn + 1; replaying them on top
+# of a share that reflects base_lsn reproduces the current share. A torn record
+# at the tail (crash mid-append) is cut off when the log is opened.
+#
+# Group commit: append() only writes the record to the file; durable(lsn) waits
+# until some fsync covers it. The first waiter starts a flusher that sleeps for
+# the commit window, then fsyncs once for every record appended so far, so
+# concurrent writes share one fsync instead of paying one each.
+WAL_MAGIC = b"DUORAMWL"
+WAL_HDR   = struct.Struct("<8sQ")
+REC_HDR   = struct.Struct("<IQB")
+REC_CRC   = struct.Struct("<I")
+
+KIND_VEC = 1  # payload: the flattened write vector, big-endian i64 (as on the wire)
+KIND_DPF = 2  # payload: [rows:u32 big-endian][dpf key] of an OP_WRITE_DPF
+KIND_RESIZE = 3  # payload: the new row count, u32 big-endian
+KIND_FIELD = 4   # payload: [rows:u32][field:u32][dpf key] of an OP_ADD_DPF
+KIND_TRANSFER = 5  # payload: [rows:u32][field:u32][len:u32][debit key][credit key] of an OP_TRANSFER_DPF
+
+class WriteAheadLog:
+    def __init__(self, path, window):
+        self.path, self.window = path, window
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(WAL_HDR.pack(WAL_MAGIC, 0))
+                f.flush()
+                os.fsync(f.fileno())
+        end, self.base_lsn, self.lsn = self._scan()
+        self.fd = os.open(path, os.O_WRONLY)
+        os.ftruncate(self.fd, end)
+        os.lseek(self.fd, end, os.SEEK_SET)
+        self.synced = self.lsn
+        self.waiters = []
+        self.flusher = None
+
+    def _scan(self):
+        with open(self.path, "rb") as f:
+            magic, base_lsn = WAL_HDR.unpack(f.read(WAL_HDR.size))
+            if magic != WAL_MAGIC: raise RuntimeError(f"{self.path}: not a write-ahead log")
+            end, lsn = WAL_HDR.size, base_lsn
+            for rec_lsn, _, _, rec_end in self._iter(f):
+                if rec_lsn != lsn + 1: break
+                end, lsn = rec_end, rec_lsn
+        return end, base_lsn, lsn
+
+    @staticmethod
+    def _iter(f):
+        while True:
+            hdr = f.read(REC_HDR.size)
+            if len(hdr) < REC_HDR.size: return
+            n, lsn, kind = REC_HDR.unpack(hdr)
+            payload, crc = f.read(n), f.read(REC_CRC.size)
+            if len(payload) < n or len(crc) < REC_CRC.size: return
+            if REC_CRC.unpack(crc)[0] != zlib.crc32(hdr + payload): return
+            yield lsn, kind, payload, f.tell()
+
+    # (lsn, kind, payload) for every record after the given lsn
+    def records(self, after):
+        with open(self.path, "rb") as f:
+            f.seek(WAL_HDR.size)
+            for lsn, kind, payload, _ in self._iter(f):
+                if lsn > self.lsn: return
+                if lsn > after: yield lsn, kind, payload
+
+    def append(self, kind, payload):
+        self.lsn += 1
+        hdr = REC_HDR.pack(len(payload), self.lsn, kind)
+        os.write(self.fd, hdr + payload + REC_CRC.pack(zlib.crc32(hdr + payload)))
+        return self.lsn
+
+    async def durable(self, lsn):
+        if lsn <= self.synced: return
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._flush())
+        await fut
+
+    async def _flush(self):
+        try:
+            await asyncio.sleep(self.window)
+            while self.waiters:
+                upto, waiters, self.waiters = self.lsn, self.waiters, []
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, os.fsync, self.fd)
+                except OSError as e:
+                    for fut in waiters:
+                        if not fut.done(): fut.set_exception(e)
+                    continue
+                self.synced = upto
+                for fut in waiters:
+                    if not fut.done(): fut.set_result(None)
+        finally:
+            self.flusher = None
+
+    def close(self):
+        os.fsync(self.fd)
+        os.close(self.fd)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import struct
+import numpy as np
+from ring import RING_DTYPE, to_ring, to_i64
+
+# Big-endian framing shared by the client, the parties and the share server.
+# A vector of n ring elements is n*8 bytes of big-endian i64, moved in one
+# sendall()/recv_into() loop rather than one syscall per element.
+WIRE_DTYPE = np.dtype(">u8")
+
+def pack_u8(x):  return struct.pack("!B", x)
+def pack_u32(x): return struct.pack("!I", x & 0xFFFFFFFF)
+def pack_i64(x): return struct.pack("!q", to_i64(x))
+
+def encode_vec(v): return memoryview(to_ring(v).astype(WIRE_DTYPE)).cast("B")
+def decode_vec(buf): return np.frombuffer(buf, dtype=WIRE_DTYPE).astype(RING_DTYPE)
+
+# ---------- blocking sockets ----------
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    mv, got = memoryview(buf), 0
+    while got < n:
+        k = sock.recv_into(mv[got:], n - got)
+        if not k: raise ConnectionError("eof")
+        got += k
+    return buf
+
+def read_u8(s):     return struct.unpack("!B", recv_exact(s,1))[0]
+def read_u32(s):    return struct.unpack("!I", recv_exact(s,4))[0]
+def read_i64(s):    return struct.unpack("!q", recv_exact(s,8))[0]
+def read_vec(s, n): return decode_vec(recv_exact(s, 8*n))
+def send_vec(s, v): s.sendall(encode_vec(v))
+
+# ---------- asyncio streams ----------
+async def aread_u8(r):     return struct.unpack("!B", await r.readexactly(1))[0]
+async def aread_u32(r):    return struct.unpack("!I", await r.readexactly(4))[0]
+async def aread_i64(r):    return struct.unpack("!q", await r.readexactly(8))[0]
+async def aread_vec(r, n): return decode_vec(await r.readexactly(8*n))
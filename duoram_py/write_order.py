@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import asyncio, collections, struct
+
+# One order of writes for both parties.
+#
+# Epochs (epochs.py) count writes, so epoch e must cover the same writes on
+# both parties even when several clients write at once and the two halves of
+# their writes reach A and B in different orders. Every write carries a wid
+# the client sends to both parties, and A decides for each wid whether it is
+# applied and in which order:
+#
+#   B, holding its half, tells A READY under the wid. A applies its half only
+#   once B is ready, and sends B the epoch the write starts under the wid
+#   (TAG_ORDER); B applies its half once every earlier write is applied here.
+#   A write whose half B does not announce within timeout is dropped: A sends
+#   epoch 0 instead and neither party applies it. B, holding a half A has not
+#   decided on within timeout, asks A to give it up (GIVE_UP); A drops it
+#   unless it already applied it, and B follows A's answer either way.
+#
+# So a write is applied on both parties or on neither, and B never waits on a
+# write it does not hold. If B still cannot apply a numbered write in turn (a
+# party restarted between applying and telling), the shares have diverged: B
+# says so and refuses every request from then on (check(); its read workers
+# too, see SharedVersion), so reads fail instead of returning garbage, until
+# both parties are restored. A new link connection starts B over at A's
+# numbering.
+TAG_ORDER = 0x16  # A -> B: [epoch:i64], 0: dropped
+TAG_READY = 0x17  # B -> A: [what:u8]
+ORDER = struct.Struct("!q")
+READY, GIVE_UP = 0, 1
+KEEP = 4096  # decisions remembered per party
+
+class WriteOrder:
+    def __init__(self, role, link, epochs, timeout=None):
+        self.role, self.link, self.epochs, self.timeout = role, link, epochs, timeout
+        self.ready = collections.OrderedDict()    # wid -> None, B holds its half (A)
+        self.decided = collections.OrderedDict()  # wid -> epoch A gave it, 0: dropped (both)
+        self.waiting = {}                         # wid -> future woken on news about it
+        self.conn = None
+        self.diverged = None
+        self.tasks = set()
+        if role == "A": link.handlers[TAG_READY] = self._ready
+        else: link.handlers[TAG_ORDER] = self._numbered
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _remember(self, d, wid, value):
+        d[wid] = value
+        while len(d) > KEEP: d.popitem(last=False)
+
+    def check(self):
+        if self.diverged: raise RuntimeError(f"shares diverged: {self.diverged}; restore both parties from a snapshot")
+
+    def _diverge(self, why):
+        if self.diverged: return
+        self.diverged = why
+        print(f"[{self.role}] SHARES DIVERGED: {why}; refusing reads and writes")
+        if self.epochs.version is not None: self.epochs.version.diverge()
+        self._wake()
+
+    # wait (up to timeout, None: forever) until done() holds, woken by news about wid
+    async def _until(self, wid, done, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not done():
+            fut = self.waiting[wid] = loop.create_future()
+            try:
+                left = None if deadline is None else deadline - loop.time()
+                if left is not None and left <= 0: return False
+                await asyncio.wait_for(fut, left)
+            except asyncio.TimeoutError:
+                return done()
+            finally:
+                self.waiting.pop(wid, None)
+        return True
+
+    def _wake(self, wid=None):
+        for w, fut in list(self.waiting.items()):
+            if (wid is None or w == wid) and not fut.done(): fut.set_result(None)
+
+    # wait until write wid may be applied; apply it with no await after this
+    async def turn(self, wid):
+        if self.role == "A":
+            self.check()
+            if wid not in self.decided and not await self._until(wid, lambda: wid in self.ready or wid in self.decided,
+                                                                   self.timeout):
+                self._drop(wid)
+            if wid in self.decided:
+                raise RuntimeError("write already applied" if self.decided[wid]
+                                   else "write dropped: its other half did not arrive in time")
+            return
+
+        if self.diverged: self._spawn(self.link.send(wid, TAG_READY, bytes([GIVE_UP])))
+        self.check()
+        self._spawn(self.link.send(wid, TAG_READY, bytes([READY])))
+        if not await self._until(wid, lambda: wid in self.decided, self.timeout):
+            self._spawn(self.link.send(wid, TAG_READY, bytes([GIVE_UP])))
+            if not await self._until(wid, lambda: wid in self.decided, self.timeout):
+                raise RuntimeError("write not decided by A")
+        e = self.decided[wid]
+        if not e: raise RuntimeError("write dropped by A: its other half did not arrive in time")
+        if not await self._until(wid, lambda: self.epochs.epoch + 1 >= e or self.diverged, self.timeout) \
+                or self.epochs.epoch + 1 != e:
+            self._diverge(f"write {wid} is epoch {e} on A, this party is at {self.epochs.epoch}")
+        self.check()
+
+    # call right after the write was applied (and counted by epochs)
+    def applied(self, wid):
+        if self.role == "A":
+            self._remember(self.decided, wid, self.epochs.epoch)
+            self._spawn(self.link.send(wid, TAG_ORDER, ORDER.pack(self.epochs.epoch)))
+        else:
+            self._wake()
+
+    def _drop(self, wid):
+        self._remember(self.decided, wid, 0)
+        self._spawn(self.link.send(wid, TAG_ORDER, ORDER.pack(0)))
+
+    def _ready(self, wid, body):
+        if body[0] == GIVE_UP:
+            if wid not in self.decided: self._drop(wid)
+        else:
+            self._remember(self.ready, wid, None)
+        self._wake(wid)
+
+    def _numbered(self, wid, body):
+        e = ORDER.unpack(body)[0]
+        if e and self.link.w is not self.conn:
+            self.conn = self.link.w
+            self.epochs.rebase(e - 1)
+        self._remember(self.decided, wid, e)
+        self._wake()